@@ -0,0 +1,266 @@
+"""Offline benchmark of the agent loop.
+
+Drives `Chat.run` and `CliChat.run` against the document server running
+in-process, with the scripted FakeProvider standing in for the model, so it
+needs no network nor API key. Each sweep grows one dimension (servers, tools,
+docs or history length) while the others stay at their baseline, and reports
+per-turn latency, MCP requests per turn and peak traced memory.
+
+    python benchmarks/bench_agent_loop.py
+    python benchmarks/bench_agent_loop.py --turns 50 --docs 6,1000,10000 --json results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, asdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcp.server.fastmcp import FastMCP
+from mcp.types import ToolAnnotations
+
+import mcp_server
+from mcp_client import MCPClient
+from core.base import ProviderType
+from core.llm_provider import LLMFactory
+from core.tools import ToolManager
+from core.chat import Chat
+from core.cli_chat import CliChat
+
+BASELINE = {"servers": 1, "tools": 0, "docs": len(mcp_server.docs), "history": 0}
+SYNTHETIC_DOC_PREFIX = "bench-"
+WORDS = "condenser tower budget plan testimony outlook equipment report schedule risk".split()
+
+
+@dataclass
+class Result:
+    mode: str
+    servers: int
+    tools: int
+    docs: int
+    history: int
+    turns: int
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    rpcs_per_turn: float
+    peak_kib: float
+
+
+def agent_script(client_id: str) -> list[dict | str]:
+    """One tool round trip (a read and a search) followed by the final answer"""
+    return [
+        {
+            "text": "Let me look that up.",
+            "tool_calls": [
+                {
+                    "name": ToolManager.namespaced_name(client_id, "read_doc_content"),
+                    "input": {"doc_id": "plan.md"},
+                },
+                {
+                    "name": ToolManager.namespaced_name(client_id, "search_docs"),
+                    "input": {"query": "project budget"},
+                },
+            ],
+        },
+        "The plan outlines the implementation steps.",
+    ]
+
+
+def synthetic_tool_server(tool_count: int) -> FastMCP:
+    server = FastMCP("BenchTools", log_level="ERROR")
+    for i in range(tool_count):
+        def noop(value: str = "") -> str:
+            return value
+
+        server.add_tool(
+            noop,
+            name=f"noop_{i}",
+            description=f"Synthetic tool number {i}, echoes its input",
+            annotations=ToolAnnotations(readOnlyHint=True),
+        )
+    return server
+
+
+def set_doc_count(count: int) -> None:
+    """Pads the document server with synthetic docs, or removes them, to hold `count` docs"""
+    for doc_id in [d for d in mcp_server.docs.ids() if d.startswith(SYNTHETIC_DOC_PREFIX)]:
+        mcp_server.docs.remove(doc_id)
+        mcp_server.search_index.remove(doc_id)
+    for i in range(count - len(mcp_server.docs)):
+        doc_id = f"{SYNTHETIC_DOC_PREFIX}{i}.md"
+        text = " ".join(WORDS[(i + j) % len(WORDS)] for j in range(200))
+        mcp_server.docs.put(doc_id, text)
+        mcp_server.search_index.add(doc_id, text)
+
+
+def seed_history(length: int) -> list[dict]:
+    """Earlier question/answer pairs, `length` messages in total"""
+    history = []
+    for i in range(length):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": f"Message {i}: " + " ".join(WORDS) * 2})
+    return history
+
+
+def count_requests(client: MCPClient, counter: Counter) -> None:
+    """Counts the requests the client's session sends, by method"""
+    session = client.session()
+    send_request = session.send_request
+
+    async def counting_send_request(request, *args, **kwargs):
+        counter[request.root.method] += 1
+        return await send_request(request, *args, **kwargs)
+
+    session.send_request = counting_send_request
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct), len(ordered) - 1)]
+
+
+async def run_scenario(
+    mode: str,
+    servers: int,
+    tools: int,
+    docs: int,
+    history: int,
+    turns: int,
+    memory_turns: int,
+    result_cache_size: int,
+) -> Result:
+    set_doc_count(docs)
+
+    clients: dict[str, MCPClient] = {"doc_client": MCPClient.in_process(mcp_server.mcp, cache_resources=True)}
+    for i in range(1, servers):
+        clients[f"doc_client_{i}"] = MCPClient.in_process(mcp_server.mcp, cache_resources=True)
+    if tools:
+        clients["bench_tools"] = MCPClient.in_process(synthetic_tool_server(tools))
+
+    await asyncio.gather(*(client.start() for client in clients.values()))
+    try:
+        counter = Counter()
+        for client in clients.values():
+            count_requests(client, counter)
+
+        llm_service = LLMFactory.create_provider(
+            ProviderType.FAKE, model="bench", script=agent_script("doc_client")
+        )
+        tool_manager = ToolManager(clients, result_cache_size=result_cache_size)
+        if mode == "cli":
+            chat = CliChat(clients["doc_client"], clients, llm_service, tool_manager)
+            query = "What does @plan.md say about the schedule?"
+        else:
+            chat = Chat(llm_service, clients, tool_manager)
+            query = "What does plan.md say about the schedule?"
+        seeded = seed_history(history)
+
+        async def turn() -> None:
+            chat.messages = list(seeded)
+            llm_service.reset()
+            # Chat prints the model's text between tool calls
+            with contextlib.redirect_stdout(io.StringIO()):
+                await chat.run(query)
+
+        # Warm up caches and the routing index, like any turn after the first
+        await turn()
+        counter.clear()
+
+        latencies = []
+        for _ in range(turns):
+            start = time.perf_counter()
+            await turn()
+            latencies.append((time.perf_counter() - start) * 1000)
+        rpcs = sum(counter.values())
+
+        tracemalloc.start()
+        try:
+            for _ in range(memory_turns):
+                await turn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        await asyncio.gather(*(client.stop() for client in clients.values()))
+
+    return Result(
+        mode=mode,
+        servers=servers,
+        tools=tools,
+        docs=docs,
+        history=history,
+        turns=turns,
+        mean_ms=statistics.fmean(latencies),
+        p50_ms=percentile(latencies, 0.5),
+        p95_ms=percentile(latencies, 0.95),
+        rpcs_per_turn=rpcs / turns,
+        peak_kib=peak / 1024,
+    )
+
+
+def int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["chat", "cli", "both"], default="both")
+    parser.add_argument("--turns", type=int, default=20, help="Measured turns per scenario")
+    parser.add_argument("--memory-turns", type=int, default=3, help="Turns traced for peak memory")
+    parser.add_argument("--servers", type=int_list, default=[1, 2, 4])
+    parser.add_argument("--tools", type=int_list, default=[0, 32, 128], help="Extra synthetic tools")
+    parser.add_argument("--docs", type=int_list, default=[6, 100, 1000])
+    parser.add_argument("--history", type=int_list, default=[0, 50, 200], help="Seeded history messages")
+    parser.add_argument(
+        "--result-cache-size", type=int, default=0,
+        help="Tool result cache size, 0 (the default) makes every turn reach the servers",
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    modes = ["chat", "cli"] if args.mode == "both" else [args.mode]
+    sweeps = {"servers": args.servers, "tools": args.tools, "docs": args.docs, "history": args.history}
+
+    results: list[Result] = []
+    seen = set()
+    header = f"{'mode':<5} {'servers':>7} {'tools':>6} {'docs':>6} {'history':>7} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'rpc/turn':>8} {'peak KiB':>9}"
+    print(header)
+    print("-" * len(header))
+    for mode in modes:
+        for dimension, values in sweeps.items():
+            for value in values:
+                params = {**BASELINE, dimension: value}
+                if (mode, *params.values()) in seen:
+                    continue
+                seen.add((mode, *params.values()))
+                result = await run_scenario(
+                    mode,
+                    turns=args.turns,
+                    memory_turns=args.memory_turns,
+                    result_cache_size=args.result_cache_size,
+                    **params,
+                )
+                results.append(result)
+                print(
+                    f"{result.mode:<5} {result.servers:>7} {result.tools:>6} {result.docs:>6} {result.history:>7} "
+                    f"{result.mean_ms:>8.2f} {result.p50_ms:>8.2f} {result.p95_ms:>8.2f} "
+                    f"{result.rpcs_per_turn:>8.1f} {result.peak_kib:>9.1f}"
+                )
+    set_doc_count(BASELINE["docs"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+"""Per-keystroke latency of `@` completion over large resource sets.
+
+Types a few doc ids one character at a time against UnifiedCompleter and
+reports the mean, 90th percentile and worst time to produce the completions of a keystroke.
+
+    python benchmarks/bench_completion.py --sizes 1000,10000,100000 --fuzzy
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_toolkit.document import Document
+
+from core.cli import UnifiedCompleter
+
+EXTENSIONS = [".md", ".pdf", ".docx", ".txt"]
+
+
+def doc_ids(count: int, rng: random.Random) -> list[str]:
+    return [
+        "".join(rng.choices(string.ascii_lowercase + "_", k=rng.randint(6, 24)))
+        + rng.choice(EXTENSIONS)
+        for _ in range(count)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--queries", type=int, default=20, help="Doc ids typed per size")
+    parser.add_argument("--fuzzy", action="store_true", help="Also rank fuzzy matches")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'docs':>8} {'build ms':>9} {'mean us':>9} {'p90 us':>9} {'max us':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        ids = doc_ids(size, rng)
+        completer = UnifiedCompleter(fuzzy=args.fuzzy)
+        start = time.perf_counter()
+        completer.update_resources(ids)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        timings = []
+        for target in rng.sample(ids, args.queries):
+            # Misspell some queries so fuzzy matching has work to do
+            typed = target if rng.random() < 0.5 else target[::2]
+            for i in range(len(typed) + 1):
+                document = Document(f"tell me about @{typed[:i]}")
+                start = time.perf_counter()
+                list(completer.get_completions(document, None))
+                timings.append((time.perf_counter() - start) * 1e6)
+
+        p90 = statistics.quantiles(timings, n=10)[-1]
+        print(
+            f"{size:>8} {build_ms:>9.1f} {sum(timings) / len(timings):>9.1f} {p90:>9.1f} {max(timings):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Startup cost of the CLI per provider, up to the point the first prompt is shown.
+
+Each run is a fresh interpreter that imports main and creates the provider,
+the work done before the MCP servers are started and the prompt appears.
+Reports the median wall time and which provider SDKs ended up imported.
+
+    python benchmarks/bench_startup.py --providers fake,ollama,claude --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SDKS = ["anthropic", "ollama", "starlette", "uvicorn"]
+
+SNIPPET = f"""
+import sys
+import main
+main.create_llm_service()
+print(",".join(sdk for sdk in {SDKS!r} if sdk in sys.modules))
+"""
+
+
+def run_once(provider: str) -> tuple[float, str]:
+    env = {
+        **os.environ,
+        "PROVIDER": provider,
+        "MODEL": os.environ.get("MODEL", "bench-model"),
+        "API_KEY": os.environ.get("API_KEY", "bench-key"),
+        "PYTHONPATH": ROOT,
+    }
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", SNIPPET],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+    return elapsed, result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", default="fake,ollama,claude")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'provider':>10} {'median ms':>10} {'min ms':>8}  imported SDKs")
+    for provider in args.providers.split(","):
+        # The first run warms the filesystem and bytecode caches
+        run_once(provider)
+        timings = []
+        for _ in range(args.runs):
+            elapsed, imported = run_once(provider)
+            timings.append(elapsed * 1000)
+        print(
+            f"{provider:>10} {statistics.median(timings):>10.1f} {min(timings):>8.1f}  {imported or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
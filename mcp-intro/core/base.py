@@ -1,4 +1,5 @@
-from typing import Protocol, Any
+from typing import Protocol, Any, AsyncIterator, Literal
+from dataclasses import dataclass
 from enum import Enum
 
 class ProviderType(Enum):
@@ -6,6 +7,24 @@ class ProviderType(Enum):
     OPENAI = "openai"
     GEMINI = "gemini"
     OLLAMA = "ollama"
+    # Scripted offline provider, for benchmarks and local runs
+    FAKE = "fake"
+
+@dataclass
+class StreamEvent:
+    """A single event of a streamed chat turn.
+
+    - text: a text delta in `text`
+    - tool_use: the model started a tool call named `tool_name`
+    - tool_result: a tool call finished, its output is in `text`
+    - message: the complete provider response, in `message`
+    """
+    type: Literal["text", "tool_use", "tool_result", "message"]
+    text: str = ""
+    tool_name: str | None = None
+    is_error: bool = False
+    message: Any = None
+
 
 class LLMProvider(Protocol):
     """Protocol defining the LLM interface for providers"""
@@ -27,6 +46,10 @@ class LLMProvider(Protocol):
         """Check if the response contains tool calls"""
         ...
     
+    def usage(self, response: Any) -> dict[str, int]:
+        """Token usage of a response, e.g. input_tokens and output_tokens"""
+        ...
+
     def chat(
         self,
         messages: list[dict],
@@ -40,5 +63,49 @@ class LLMProvider(Protocol):
     ) -> Any:
         """Send chat request and return response"""
         ...
-    
 
+
+class AsyncLLMProvider(LLMProvider, Protocol):
+    """Protocol for providers that can also be awaited without blocking the event loop"""
+
+    async def achat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> Any:
+        """Send chat request asynchronously and return response"""
+        ...
+
+    def astream(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> AsyncIterator[StreamEvent]:
+        """Stream a chat request, ending with a `message` event holding the full response"""
+        ...
+
+
+class ProviderWrapper:
+    """Base for providers adding behaviour around another provider, e.g. caching.
+
+    Anything a subclass doesn't override is delegated to the wrapped provider,
+    including its `_provider_type`, so a wrapper can stand in for it anywhere.
+    """
+
+    def __init__(self, provider: AsyncLLMProvider):
+        self.provider = provider
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.provider, name)
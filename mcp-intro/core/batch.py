@@ -0,0 +1,158 @@
+import sys
+import json
+import time
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Optional, TextIO
+
+from core.chat import Chat
+
+
+@dataclass
+class BatchResult:
+    id: str
+    response: Optional[str] = None
+    latency_ms: float = 0.0
+    usage: dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchSummary:
+    total: int = 0
+    failed: int = 0
+    elapsed_s: float = 0.0
+    usage: Counter = field(default_factory=Counter)
+
+    def __str__(self) -> str:
+        rate = self.total / self.elapsed_s if self.elapsed_s else 0.0
+        tokens = ", ".join(f"{kind}={count}" for kind, count in sorted(self.usage.items()))
+        return (
+            f"{self.total} queries ({self.failed} failed) in {self.elapsed_s:.2f}s, "
+            f"{rate:.2f} queries/s. Tokens: {tokens or 'n/a'}"
+        )
+
+
+def parse_query(line: str, line_number: int) -> tuple[str, str]:
+    """Parses an input line, either `{"id": ..., "query": ...}` or a JSON string.
+
+    The id defaults to the line number.
+    """
+    record = json.loads(line)
+    if isinstance(record, str):
+        return str(line_number), record
+    if not isinstance(record, dict) or not isinstance(record.get("query"), str):
+        raise ValueError('Expected a JSON string or an object with a "query" string')
+    return str(record.get("id", line_number)), record["query"]
+
+
+class BatchRunner:
+    """Runs queries from a JSONL stream across concurrent, independent chat sessions.
+
+    Every session is a Chat built by `make_session`, so they can share MCP
+    clients and a ToolManager while keeping their own history. Each query
+    starts from an empty history. Results are written as JSONL in completion
+    order, one line per query.
+    """
+
+    def __init__(
+        self,
+        make_session: Callable[[], Chat],
+        concurrency: int = 8,
+    ):
+        self.make_session = make_session
+        self.concurrency = concurrency
+
+    async def _read(self, source: TextIO, queue: asyncio.Queue, results: asyncio.Queue) -> None:
+        line_number = 0
+        while True:
+            line = await asyncio.to_thread(source.readline)
+            if not line:
+                break
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                item = parse_query(line, line_number)
+            except ValueError as e:
+                # json.JSONDecodeError is a ValueError too
+                await results.put(BatchResult(id=str(line_number), error=f"Invalid input: {e}"))
+                continue
+            # Bounded, so a huge input is streamed rather than loaded
+            await queue.put(item)
+        for _ in range(self.concurrency):
+            await queue.put(None)
+
+    async def _work(self, queue: asyncio.Queue, results: asyncio.Queue) -> None:
+        session = self.make_session()
+        # Results own stdout, so what the session prints goes to stderr
+        session.output = sys.stderr
+        while (item := await queue.get()) is not None:
+            query_id, query = item
+            session.messages = []
+            session.usage.clear()
+            start = time.perf_counter()
+            result = BatchResult(id=query_id)
+            try:
+                result.response = await session.run(query)
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+            result.latency_ms = round((time.perf_counter() - start) * 1000, 1)
+            result.usage = dict(session.usage)
+            await results.put(result)
+
+    async def run(self, source: TextIO, output: TextIO) -> BatchSummary:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue()
+        summary = BatchSummary()
+        start = time.perf_counter()
+
+        async def process() -> None:
+            try:
+                # A task group, so a failing worker cancels the reader and the
+                # other workers instead of leaving them blocked on the queue
+                async with asyncio.TaskGroup() as tasks:
+                    tasks.create_task(self._read(source, queue, results))
+                    for _ in range(self.concurrency):
+                        tasks.create_task(self._work(queue, results))
+            finally:
+                results.put_nowait(None)
+
+        processing = asyncio.create_task(process())
+        try:
+            while (result := await results.get()) is not None:
+                output.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+                output.flush()
+                summary.total += 1
+                summary.failed += result.error is not None
+                summary.usage.update(result.usage)
+            await processing
+        finally:
+            if not processing.done():
+                processing.cancel()
+                await asyncio.gather(processing, return_exceptions=True)
+
+        summary.elapsed_s = time.perf_counter() - start
+        return summary
+
+
+async def run_batch(
+    make_session: Callable[[], Chat],
+    input_path: str,
+    output_path: Optional[str] = None,
+    concurrency: int = 8,
+) -> BatchSummary:
+    """Runs a JSONL file of queries ("-" for stdin), writing results to a file or stdout.
+
+    Anything the sessions print goes to stderr, so stdout only carries results.
+    """
+    source = sys.stdin if input_path == "-" else open(input_path)
+    output = sys.stdout if output_path in (None, "-") else open(output_path, "w")
+    try:
+        return await BatchRunner(make_session, concurrency).run(source, output)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
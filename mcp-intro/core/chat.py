@@ -1,14 +1,39 @@
-from core.base import LLMProvider
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, AsyncIterator, TextIO
+from core.base import AsyncLLMProvider, StreamEvent
 from mcp_client import MCPClient
 from core.tools import ToolManager
-from anthropic.types import MessageParam
+from core.context import ContextWindow, content_text
+from core.telemetry import Span, telemetry
+
+if TYPE_CHECKING:
+    from anthropic.types import MessageParam
+    from core.session_store import SessionLog
 
 
 class Chat:
-    def __init__(self, llm_service: LLMProvider, clients: dict[str, MCPClient]):
-        self.llm_service: LLMProvider = llm_service
+    def __init__(
+        self,
+        llm_service: AsyncLLMProvider,
+        clients: dict[str, MCPClient],
+        tool_manager: ToolManager | None = None,
+        context: ContextWindow | None = None,
+        temperature: float = 1.0,
+        session_log: "SessionLog | None" = None,
+    ):
+        self.llm_service: AsyncLLMProvider = llm_service
         self.clients: dict[str, MCPClient] = clients
-        self.messages: list[MessageParam] = []
+        self.tool_manager: ToolManager = tool_manager or ToolManager(clients)
+        self.context: ContextWindow = context or ContextWindow()
+        self.temperature = temperature
+        # Where the history is saved as it grows, if anywhere
+        self.session_log = session_log
+        self.messages: list["MessageParam"] = []
+        # Tokens used by this session, by kind (input_tokens, output_tokens, ...)
+        self.usage: Counter[str] = Counter()
+        # Where the text sent along with tool calls is printed, stdout if None
+        self.output: TextIO | None = None
 
     async def _process_query(self, query: str):
         self.messages.append({"role": "user", "content": query})
@@ -18,31 +43,140 @@ class Chat:
         if not self.llm_service.has_tool_calls(response):
             return False
             
-        print(self.llm_service.text_from_message(response))
-        tool_result_parts = await ToolManager.execute_tool_requests(
-            self.clients, response
+        print(self.llm_service.text_from_message(response), file=self.output)
+        await self._execute_tool_calls(response)
+        return True
+
+    async def _execute_tool_calls(self, response) -> list:
+        """Run the response's tool calls and add their results to the history."""
+        tool_result_parts = await self.tool_manager.execute_tool_requests(
+            response
         )
         
         self.llm_service.add_user_message(
             self.messages, tool_result_parts
         )
-        return True
+        return tool_result_parts
+
+    def _save(self, query: str) -> None:
+        if self.session_log is not None:
+            self.session_log.save(self.messages, query=query)
+
+    def _llm_span(self, tools: list[dict]):
+        """Span around a model request, tagged with the size of what is sent"""
+        provider_type = self.llm_service._provider_type
+        return telemetry.span(
+            "llm.chat",
+            provider=provider_type.value if provider_type else "",
+            model=getattr(self.llm_service, "model", ""),
+            messages=len(self.messages),
+            tools=len(tools),
+            request_chars=sum(
+                len(content_text(message.get("content"))) for message in self.messages
+            ),
+        )
+
+    def _record_usage(self, span: Span, response: Any) -> None:
+        try:
+            usage = self.llm_service.usage(response)
+        except NotImplementedError:
+            return
+        provider_type = self.llm_service._provider_type
+        self.usage.update(usage)
+        for kind, tokens in usage.items():
+            span.set(kind, tokens)
+            telemetry.count(
+                "llm_tokens_total",
+                tokens,
+                provider=provider_type.value if provider_type else "",
+                type=kind,
+            )
 
     async def run(
         self,
         query: str,
     ) -> str:
-        await self._process_query(query)
+        with telemetry.span("chat.turn"):
+            await self._process_query(query)
 
-        while True:
-            response = self.llm_service.chat(
-                messages=self.messages,
-                tools=await ToolManager.get_all_tools(self.clients, self.llm_service),
-            )
+            iteration = 0
+            while True:
+                iteration += 1
+                with telemetry.span("agent.iteration", iteration=iteration):
+                    await self.context.compact(self.messages)
+                    tools = await self.tool_manager.get_all_tools(self.llm_service)
+                    with self._llm_span(tools) as span:
+                        response = await self.llm_service.achat(
+                            messages=self.messages,
+                            temperature=self.temperature,
+                            tools=tools,
+                        )
+                        self._record_usage(span, response)
+
+                    self.llm_service.add_assistant_message(self.messages, response.content)
+
+                    # Handle tool calls if present, otherwise return the final response
+                    # TODO execute_tool_requests needs to be updated to handle ollama
+                    handled = await self._handle_tool_calls(response)
+                    # Saved once tool calls have their results, so a resumed history is valid
+                    self._save(query)
+                    if not handled:
+                        return self.llm_service.text_from_message(response)
+
+    async def run_stream(
+        self,
+        query: str,
+    ) -> AsyncIterator[StreamEvent]:
+        """Streaming counterpart of `run`.
+
+        Yields text deltas and tool_use/tool_result events as they happen,
+        and a final `message` event with the last provider response.
+        """
+        with telemetry.span("chat.turn", stream=True):
+            await self._process_query(query)
+
+            iteration = 0
+            while True:
+                iteration += 1
+                with telemetry.span("agent.iteration", iteration=iteration):
+                    await self.context.compact(self.messages)
+                    tools = await self.tool_manager.get_all_tools(self.llm_service)
+                    response = None
+                    with self._llm_span(tools) as span:
+                        start = time.perf_counter()
+                        async for event in self.llm_service.astream(
+                            messages=self.messages,
+                            temperature=self.temperature,
+                            tools=tools,
+                        ):
+                            if event.type == "message":
+                                response = event.message
+                            else:
+                                if "time_to_first_event_ms" not in span.attributes:
+                                    span.set(
+                                        "time_to_first_event_ms",
+                                        (time.perf_counter() - start) * 1000,
+                                    )
+                                yield event
+                        self._record_usage(span, response)
+
+                    self.llm_service.add_assistant_message(self.messages, response.content)
 
-            self.llm_service.add_assistant_message(self.messages, response.content)
+                    if not self.llm_service.has_tool_calls(response):
+                        self._save(query)
+                        yield StreamEvent("message", message=response)
+                        return
 
-            # Handle tool calls if present, otherwise return the final response
-            # TODO execute_tool_requests needs to be updated to handle ollama
-            if not await self._handle_tool_calls(response):
-                return self.llm_service.text_from_message(response)
+                    tool_names = {
+                        block.id: block.name
+                        for block in self.tool_manager.tool_requests(response)
+                    }
+                    tool_result_parts = await self._execute_tool_calls(response)
+                    self._save(query)
+                    for part in tool_result_parts:
+                        yield StreamEvent(
+                            "tool_result",
+                            text=part["content"],
+                            tool_name=tool_names.get(part["tool_use_id"]),
+                            is_error=part["is_error"],
+                        )
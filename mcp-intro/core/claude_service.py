@@ -1,15 +1,30 @@
-from anthropic import Anthropic
+from typing import AsyncIterator
+from anthropic import Anthropic, AsyncAnthropic
 from anthropic.types import Message
-from core.base import ProviderType
+from core.base import ProviderType, StreamEvent
+
+CACHE_CONTROL = {"type": "ephemeral"}
 
 
 class ClaudeProvider:
 
     _provider_type: ProviderType = None
 
-    def __init__(self, model: str, api_key: str, *args, **kwargs):
-        self.client = Anthropic(api_key=api_key)
+    def __init__(
+        self,
+        model: str,
+        api_key: str,
+        *args,
+        prompt_caching: bool = True,
+        max_retries: int = 2,
+        **kwargs,
+    ):
+        # NOTE pass max_retries=0 when wrapping in RateLimitedProvider, so retries
+        # happen in one place and respect its limits
+        self.client = Anthropic(api_key=api_key, max_retries=max_retries)
+        self.async_client = AsyncAnthropic(api_key=api_key, max_retries=max_retries)
         self.model = model
+        self.prompt_caching = prompt_caching
 
     def add_user_message(self, messages: list[dict], message: dict):
         user_message = {
@@ -38,7 +53,35 @@ class ClaudeProvider:
         """Check if the response contains tool calls"""
         return response.stop_reason == "tool_use"
 
-    def chat(
+    def usage(self, response: Message) -> dict[str, int]:
+        """Token usage of a response, including prompt cache reads and writes"""
+        usage = response.usage
+        return {
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cache_read_input_tokens": usage.cache_read_input_tokens or 0,
+            "cache_creation_input_tokens": usage.cache_creation_input_tokens or 0,
+        }
+
+    @staticmethod
+    def _with_cache_breakpoint(message: dict) -> dict:
+        """Returns a copy of the message with a cache breakpoint on its last content block"""
+        content = message["content"]
+        if isinstance(content, str):
+            if not content:
+                return message
+            blocks = [{"type": "text", "text": content}]
+        else:
+            blocks = [
+                block if isinstance(block, dict) else block.model_dump(exclude_none=True)
+                for block in content
+            ]
+            if not blocks:
+                return message
+        blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+        return {**message, "content": blocks}
+
+    def _build_params(
         self,
         messages,
         system=None,
@@ -47,7 +90,7 @@ class ClaudeProvider:
         tools=None,
         thinking=False,
         thinking_budget=1024,
-    ) -> Message:
+    ) -> dict:
         params = {
             "model": self.model,
             "max_tokens": 8000,
@@ -68,5 +111,104 @@ class ClaudeProvider:
         if system:
             params["system"] = system
 
+        if self.prompt_caching:
+            self._add_cache_breakpoints(params)
+
+        return params
+
+    def _add_cache_breakpoints(self, params: dict) -> None:
+        """Marks the tools, system prompt and history as a cacheable prefix.
+
+        Every message sent is replayed verbatim on the next agent-loop call,
+        so a breakpoint on the latest message lets the next request read the
+        whole history from cache. Inputs are copied, never mutated.
+        """
+        if params.get("tools"):
+            tools = list(params["tools"])
+            tools[-1] = {**tools[-1], "cache_control": CACHE_CONTROL}
+            params["tools"] = tools
+
+        if isinstance(params.get("system"), str):
+            params["system"] = [
+                {"type": "text", "text": params["system"], "cache_control": CACHE_CONTROL}
+            ]
+
+        if params["messages"]:
+            messages = list(params["messages"])
+            messages[-1] = self._with_cache_breakpoint(messages[-1])
+            params["messages"] = messages
+
+    def chat(
+        self,
+        messages,
+        system=None,
+        temperature=1.0,
+        stop_sequences=[],
+        tools=None,
+        thinking=False,
+        thinking_budget=1024,
+    ) -> Message:
+        params = self._build_params(
+            messages,
+            system=system,
+            temperature=temperature,
+            stop_sequences=stop_sequences,
+            tools=tools,
+            thinking=thinking,
+            thinking_budget=thinking_budget,
+        )
         message = self.client.messages.create(**params)
         return message
+
+    async def achat(
+        self,
+        messages,
+        system=None,
+        temperature=1.0,
+        stop_sequences=[],
+        tools=None,
+        thinking=False,
+        thinking_budget=1024,
+    ) -> Message:
+        params = self._build_params(
+            messages,
+            system=system,
+            temperature=temperature,
+            stop_sequences=stop_sequences,
+            tools=tools,
+            thinking=thinking,
+            thinking_budget=thinking_budget,
+        )
+        message = await self.async_client.messages.create(**params)
+        return message
+
+    async def astream(
+        self,
+        messages,
+        system=None,
+        temperature=1.0,
+        stop_sequences=[],
+        tools=None,
+        thinking=False,
+        thinking_budget=1024,
+    ) -> AsyncIterator[StreamEvent]:
+        params = self._build_params(
+            messages,
+            system=system,
+            temperature=temperature,
+            stop_sequences=stop_sequences,
+            tools=tools,
+            thinking=thinking,
+            thinking_budget=thinking_budget,
+        )
+        async with self.async_client.messages.stream(**params) as stream:
+            async for event in stream:
+                if event.type == "text":
+                    yield StreamEvent("text", text=event.text)
+                elif (
+                    event.type == "content_block_start"
+                    and event.content_block.type == "tool_use"
+                ):
+                    yield StreamEvent("tool_use", tool_name=event.content_block.name)
+            message = await stream.get_final_message()
+        yield StreamEvent("message", message=message)
@@ -1,14 +1,18 @@
+import asyncio
+from pathlib import Path
 from typing import List, Optional
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import Completer, Completion
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.styles import Style
-from prompt_toolkit.history import InMemoryHistory
+from prompt_toolkit.history import FileHistory, InMemoryHistory
 from prompt_toolkit.auto_suggest import AutoSuggest, Suggestion
 from prompt_toolkit.document import Document
 from prompt_toolkit.buffer import Buffer
 
 from core.cli_chat import CliChat
+from core.completion_index import CompletionIndex
+from core.telemetry import telemetry
 
 
 class CommandAutoSuggest(AutoSuggest):
@@ -37,17 +41,28 @@ class CommandAutoSuggest(AutoSuggest):
 
 
 class UnifiedCompleter(Completer):
-    def __init__(self):
+    def __init__(self, max_completions: int = 100, fuzzy: bool = False):
         self.prompts = []
         self.prompt_dict = {}
-        self.resources = []
+        self.prompt_index = CompletionIndex()
+        self.resources = CompletionIndex()
+        # Cap on completions per keystroke, and whether to add fuzzy matches
+        # when there are fewer prefix matches than that
+        self.max_completions = max_completions
+        self.fuzzy = fuzzy
 
     def update_prompts(self, prompts: List):
         self.prompts = prompts
         self.prompt_dict = {prompt.name: prompt for prompt in prompts}
+        self.prompt_index = CompletionIndex(self.prompt_dict, fuzzy=self.fuzzy)
 
     def update_resources(self, resources: List):
-        self.resources = resources
+        # Built aside and swapped in with a single assignment, so a
+        # completion running in another thread never sees a partial index
+        self.resources = CompletionIndex(resources, fuzzy=self.fuzzy)
+
+    def _resource_completions(self, prefix: str) -> list[str]:
+        return self.resources.complete(prefix, self.max_completions, self.fuzzy)
 
     def get_completions(self, document, complete_event):
         text = document.text
@@ -57,14 +72,13 @@ class UnifiedCompleter(Completer):
             last_at_pos = text_before_cursor.rfind("@")
             prefix = text_before_cursor[last_at_pos + 1 :]
 
-            for resource_id in self.resources:
-                if resource_id.lower().startswith(prefix.lower()):
-                    yield Completion(
-                        resource_id,
-                        start_position=-len(prefix),
-                        display=resource_id,
-                        display_meta="Resource",
-                    )
+            for resource_id in self._resource_completions(prefix):
+                yield Completion(
+                    resource_id,
+                    start_position=-len(prefix),
+                    display=resource_id,
+                    display_meta="Resource",
+                )
             return
 
         if text.startswith("/"):
@@ -73,21 +87,23 @@ class UnifiedCompleter(Completer):
             if len(parts) <= 1 and not text.endswith(" "):
                 cmd_prefix = parts[0] if parts else ""
 
-                for prompt in self.prompts:
-                    if prompt.name.startswith(cmd_prefix):
-                        yield Completion(
-                            prompt.name,
-                            start_position=-len(cmd_prefix),
-                            display=f"/{prompt.name}",
-                            display_meta=prompt.description or "",
-                        )
+                for name in self.prompt_index.complete(
+                    cmd_prefix, self.max_completions, self.fuzzy
+                ):
+                    prompt = self.prompt_dict[name]
+                    yield Completion(
+                        prompt.name,
+                        start_position=-len(cmd_prefix),
+                        display=f"/{prompt.name}",
+                        display_meta=prompt.description or "",
+                    )
                 return
 
             if len(parts) == 1 and text.endswith(" "):
                 cmd = parts[0]
 
                 if cmd in self.prompt_dict:
-                    for id in self.resources:
+                    for id in self._resource_completions(""):
                         yield Completion(
                             id,
                             start_position=0,
@@ -98,25 +114,39 @@ class UnifiedCompleter(Completer):
             if len(parts) >= 2:
                 doc_prefix = parts[-1]
 
-                for resource in self.resources:
-                    if "id" in resource and resource["id"].lower().startswith(
-                        doc_prefix.lower()
-                    ):
-                        yield Completion(
-                            resource["id"],
-                            start_position=-len(doc_prefix),
-                            display=resource["id"],
-                        )
+                for resource_id in self._resource_completions(doc_prefix):
+                    yield Completion(
+                        resource_id,
+                        start_position=-len(doc_prefix),
+                        display=resource_id,
+                    )
                 return
 
 
 class CliApp:
-    def __init__(self, agent: CliChat):
+    def __init__(
+        self,
+        agent: CliChat,
+        stream: bool = False,
+        fuzzy_completion: bool = False,
+        refresh_interval: float = 5.0,
+        max_refresh_interval: float = 60.0,
+        history_file: str | None = None,
+    ):
         self.agent = agent
+        self.stream = stream
         self.resources = []
         self.prompts = []
 
-        self.completer = UnifiedCompleter()
+        # Polling interval for doc ids and prompts when the server doesn't
+        # notify list changes, doubled up to the max while nothing changes.
+        # 0 disables polling.
+        self.refresh_interval = refresh_interval
+        self.max_refresh_interval = max_refresh_interval
+        self._refresh_requested = asyncio.Event()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        self.completer = UnifiedCompleter(fuzzy=fuzzy_completion)
 
         self.command_autosuggester = CommandAutoSuggest([])
 
@@ -159,7 +189,13 @@ class CliApp:
                     ):
                         buffer.start_completion(select_first=False)
 
-        self.history = InMemoryHistory()
+        if history_file:
+            # Prompts typed in earlier runs stay reachable with the up arrow
+            history_path = Path(history_file).expanduser()
+            history_path.parent.mkdir(parents=True, exist_ok=True)
+            self.history = FileHistory(str(history_path))
+        else:
+            self.history = InMemoryHistory()
         self.session = PromptSession(
             completer=self.completer,
             history=self.history,
@@ -177,34 +213,128 @@ class CliApp:
         )
 
     async def initialize(self):
-        await self.refresh_resources()
-        await self.refresh_prompts()
-
-    async def refresh_resources(self):
+        self.agent.doc_client.add_change_listener(self._on_list_changed)
+        if not self.agent.doc_client.started:
+            # A lazy server isn't spawned for completions, they load once it runs
+            return
         try:
-            self.resources = await self.agent.list_docs_ids()
-            self.completer.update_resources(self.resources)
+            await self.refresh_resources()
         except Exception as e:
             print(f"Error refreshing resources: {e}")
-
-    async def refresh_prompts(self):
         try:
-            self.prompts = await self.agent.list_prompts()
-            self.completer.update_prompts(self.prompts)
-            self.command_autosuggester = CommandAutoSuggest(self.prompts)
-            self.session.auto_suggest = self.command_autosuggester
+            await self.refresh_prompts()
         except Exception as e:
             print(f"Error refreshing prompts: {e}")
 
-    async def run(self):
+    async def refresh_resources(self, refresh: bool = False) -> bool:
+        """Reloads the doc ids, returns whether they changed"""
+        resources = await self.agent.list_docs_ids(refresh=refresh)
+        if resources == self.resources:
+            return False
+        # Indexing a large corpus takes a while, so keep it off the event loop.
+        # The completer swaps the new index in with a single assignment.
+        await asyncio.to_thread(self.completer.update_resources, resources)
+        self.resources = resources
+        return True
+
+    async def refresh_prompts(self) -> bool:
+        """Reloads the prompts, returns whether they changed"""
+        prompts = await self.agent.list_prompts()
+        if prompts == self.prompts:
+            return False
+        self.completer.update_prompts(prompts)
+        self.command_autosuggester = CommandAutoSuggest(prompts)
+        self.session.auto_suggest = self.command_autosuggester
+        self.prompts = prompts
+        return True
+
+    def _on_list_changed(self, kind: str) -> None:
+        if kind in ("resources", "prompts"):
+            self._refresh_requested.set()
+
+    async def _refresh_loop(self):
+        """Keeps completions current in the background, the prompt never waits on it.
+
+        Refreshes as soon as the server notifies a list change. Servers that
+        don't send those notifications are polled instead, backing off while
+        nothing changes or refreshing fails.
+        """
+        client = self.agent.doc_client
+        poll = self.refresh_interval > 0 and not (
+            client.notifies_list_changed("resources")
+            and client.notifies_list_changed("prompts")
+        )
+        interval = self.refresh_interval
         while True:
             try:
-                user_input = await self.session.prompt_async("> ")
-                if not user_input.strip():
-                    continue
+                await asyncio.wait_for(
+                    self._refresh_requested.wait(), interval if poll else None
+                )
+            except TimeoutError:
+                pass
+            self._refresh_requested.clear()
+            if not client.started:
+                continue
 
-                response = await self.agent.run(user_input)
-                print(f"\nResponse:\n{response}")
+            try:
+                # Both always run, a list makes `any` not short-circuit
+                changed = any([
+                    await self.refresh_resources(refresh=True),
+                    await self.refresh_prompts(),
+                ])
+            except Exception:
+                # Printing would garble the prompt, just retry later
+                changed = False
+            interval = (
+                self.refresh_interval
+                if changed
+                else min(interval * 2, self.max_refresh_interval)
+            )
 
-            except KeyboardInterrupt:
-                break
+    async def run(self):
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        try:
+            while True:
+                try:
+                    user_input = await self.session.prompt_async("> ")
+                    if not user_input.strip():
+                        continue
+
+                    if self._run_builtin_command(user_input):
+                        continue
+
+                    if self.stream:
+                        await self._print_stream(user_input)
+                    else:
+                        response = await self.agent.run(user_input)
+                        print(f"\nResponse:\n{response}")
+
+                except KeyboardInterrupt:
+                    break
+        finally:
+            self._refresh_task.cancel()
+
+    def _run_builtin_command(self, user_input: str) -> bool:
+        """Handles commands of the app itself rather than server prompts"""
+        match user_input.split():
+            case ["/stats"]:
+                print(telemetry.summary())
+            case ["/stats", "reset"]:
+                telemetry.reset()
+                print("Stats reset")
+            case _:
+                return False
+        return True
+
+    async def _print_stream(self, user_input: str):
+        print("\nResponse:")
+        async for event in self.agent.run_stream(user_input):
+            match event.type:
+                case "text":
+                    print(event.text, end="", flush=True)
+                case "tool_use":
+                    print(f"\n[calling {event.tool_name}]", flush=True)
+                case "tool_result":
+                    status = "failed" if event.is_error else "done"
+                    print(f"[{event.tool_name} {status}]", flush=True)
+        print()
@@ -1,47 +1,73 @@
-from typing import List, Tuple
+import asyncio
+from typing import TYPE_CHECKING, List, Tuple
 from mcp.types import Prompt, PromptMessage
-from anthropic.types import MessageParam
 
-from core.base import LLMProvider
+from core.base import AsyncLLMProvider
 from core.chat import Chat
+from core.tools import ToolManager
+from core.context import ContextWindow
 from mcp_client import MCPClient
 
+if TYPE_CHECKING:
+    from anthropic.types import MessageParam
+    from core.session_store import SessionLog
+
 
 class CliChat(Chat):
     def __init__(
         self,
         doc_client: MCPClient,
         clients: dict[str, MCPClient],
-        llm_service: LLMProvider,
+        llm_service: AsyncLLMProvider,
+        tool_manager: ToolManager | None = None,
+        context: ContextWindow | None = None,
+        temperature: float = 1.0,
+        session_log: "SessionLog | None" = None,
     ):
-        super().__init__(clients=clients, llm_service=llm_service)
+        super().__init__(
+            clients=clients,
+            llm_service=llm_service,
+            tool_manager=tool_manager,
+            context=context,
+            temperature=temperature,
+            session_log=session_log,
+        )
 
         self.doc_client: MCPClient = doc_client
 
     async def list_prompts(self) -> list[Prompt]:
         return await self.doc_client.list_prompts()
 
-    async def list_docs_ids(self) -> list[str]:
-        return await self.doc_client.read_resource("docs://documents")
+    async def list_docs_ids(self, refresh: bool = False) -> list[str]:
+        return await self.doc_client.read_resource("docs://documents", refresh=refresh)
 
     async def get_doc_content(self, doc_id: str) -> str:
         return await self.doc_client.read_resource(f"docs://documents/{doc_id}")
 
+    async def get_doc_info(self, doc_id: str) -> dict:
+        return await self.doc_client.read_resource(f"docs://documents/{doc_id}/info")
+
+    async def get_doc_chunk(self, doc_id: str, n: int) -> dict:
+        return await self.doc_client.read_resource(
+            f"docs://documents/{doc_id}/chunks/{n}"
+        )
+
     async def get_prompt(
         self, command: str, doc_id: str
     ) -> list[PromptMessage]:
         return await self.doc_client.get_prompt(command, {"doc_id": doc_id})
 
     async def _extract_resources(self, query: str) -> str:
-        mentions = [word[1:] for word in query.split() if word.startswith("@")]
+        mentions = {word[1:] for word in query.split() if word.startswith("@")}
+        if not mentions:
+            return ""
 
         doc_ids = await self.list_docs_ids()
-        mentioned_docs: list[Tuple[str, str]] = []
-
-        for doc_id in doc_ids:
-            if doc_id in mentions:
-                content = await self.get_doc_content(doc_id)
-                mentioned_docs.append((doc_id, content))
+        mentioned_ids = [doc_id for doc_id in doc_ids if doc_id in mentions]
+        contents = await asyncio.gather(
+            *(self.get_doc_content(doc_id) for doc_id in mentioned_ids)
+        )
+        mentioned_docs: list[Tuple[str, str]] = list(zip(mentioned_ids, contents))
 
         return "".join(
             f'\n<document id="{doc_id}">\n{content}\n</document>\n'
@@ -90,7 +116,7 @@ class CliChat(Chat):
 
 def convert_prompt_message_to_message_param(
     prompt_message: "PromptMessage",
-) -> MessageParam:
+) -> "MessageParam":
     role = "user" if prompt_message.role == "user" else "assistant"
 
     content = prompt_message.content
@@ -136,7 +162,7 @@ def convert_prompt_message_to_message_param(
 
 def convert_prompt_messages_to_message_params(
     prompt_messages: List[PromptMessage],
-) -> List[MessageParam]:
+) -> List["MessageParam"]:
     return [
         convert_prompt_message_to_message_param(msg) for msg in prompt_messages
     ]
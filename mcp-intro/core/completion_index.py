@@ -0,0 +1,194 @@
+import re
+import heapq
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Iterable, Optional
+
+# Translation table turning every nonzero byte into 1
+_NONZERO_BYTES = bytes([0] + [1] * 255)
+# Set bit offsets of every byte value
+_BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+# Masks with at most this many bits set are decoded bit by bit
+_SPARSE_BITS = 16
+
+
+@lru_cache(maxsize=64)
+def _subsequence_pattern(query: str) -> re.Pattern:
+    """Matches strings containing the characters of `query` in order"""
+    # `a[^b]*b` rather than `a.*?b` finds the same leftmost match without backtracking
+    return re.compile(
+        re.escape(query[0])
+        + "".join(f"[^{re.escape(char)}]*{re.escape(char)}" for char in query[1:])
+    )
+
+
+class CompletionIndex:
+    """Immutable, case-insensitive index of names for completion.
+
+    Names are kept sorted by their case-folded form, so prefix lookups are a
+    bisect plus a walk over the matches. For fuzzy (subsequence) lookups,
+    each position maps every character to a bitmask of the names having that
+    character there, and each character to a bitmask of the names containing
+    it. ANDing the character masks of the query prefilters the candidates.
+    Up to `max_scan` of them are ranked by matching each one, larger sets are
+    ranked with the positional masks, which stops as soon as enough matches
+    are found.
+    """
+
+    def __init__(self, names: Iterable[str] = (), fuzzy: bool = False):
+        entries = sorted((name.casefold(), name) for name in set(names))
+        self._keys = [key for key, _ in entries]
+        self._names = [name for _, name in entries]
+        self._char_masks: Optional[dict[str, int]] = None
+        self._position_masks: list[dict[str, int]] = []
+        # Built up front when fuzzy lookups are expected, so no keystroke pays for it
+        if fuzzy:
+            self._build_fuzzy_masks()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def prefix(self, prefix: str, limit: Optional[int] = None) -> list[str]:
+        """Names starting with `prefix`, in sorted order"""
+        key = prefix.casefold()
+        start = bisect_left(self._keys, key)
+        matches = []
+        for i in range(start, len(self._keys)):
+            if not self._keys[i].startswith(key) or len(matches) == limit:
+                break
+            matches.append(self._names[i])
+        return matches
+
+    def _build_fuzzy_masks(self) -> None:
+        """Sets bit i of the masks of name i's characters, per position and overall"""
+        size = (len(self._keys) + 7) // 8
+        rows: list[dict[str, bytearray]] = []
+        for i, key in enumerate(self._keys):
+            byte, bit = i >> 3, 1 << (i & 7)
+            for position, char in enumerate(key):
+                if position == len(rows):
+                    rows.append({})
+                bits = rows[position].get(char)
+                if bits is None:
+                    bits = rows[position][char] = bytearray(size)
+                bits[byte] |= bit
+        position_masks = [
+            {char: int.from_bytes(bits, "little") for char, bits in row.items()}
+            for row in rows
+        ]
+        char_masks: dict[str, int] = {}
+        for row in position_masks:
+            for char, mask in row.items():
+                char_masks[char] = char_masks.get(char, 0) | mask
+        self._position_masks = position_masks
+        self._char_masks = char_masks
+
+    @staticmethod
+    def _positions(mask: int, limit: Optional[int] = None) -> list[int]:
+        """Indexes of the first `limit` set bits of a mask"""
+        if mask.bit_count() <= _SPARSE_BITS:
+            # Peeling off the highest bits beats scanning the bytes of a sparse mask
+            positions = []
+            while mask:
+                top = mask.bit_length() - 1
+                positions.append(top)
+                mask ^= 1 << top
+            return positions[::-1][:limit]
+        data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+        # bytes.find can then skip the runs of zero bytes
+        find = data.translate(_NONZERO_BYTES).find
+        positions = []
+        i = find(1)
+        while i >= 0:
+            base = i * 8
+            positions += [base + bit for bit in _BYTE_BITS[data[i]]]
+            if limit is not None and len(positions) >= limit:
+                return positions[:limit]
+            i = find(1, i + 1)
+        return positions
+
+    def fuzzy(self, query: str, limit: int = 50, max_scan: int = 128) -> list[str]:
+        """Names containing the characters of `query` in order, best match first.
+
+        Names containing `query` itself come first, by where it starts, so
+        prefix matches lead. Then the others, by where their earliest match
+        ends. Ties are in sorted order.
+        """
+        key = query.casefold()
+        if not key:
+            return self.prefix("", limit)
+        if self._char_masks is None:
+            self._build_fuzzy_masks()
+
+        candidates = -1
+        for char in set(key):
+            candidates &= self._char_masks.get(char, 0)
+            if not candidates:
+                return []
+
+        if candidates.bit_count() <= max_scan:
+            ranked = self._rank_by_matching(key, candidates, limit)
+        else:
+            ranked = self._rank_by_position(key, candidates, limit)
+        return [self._names[i] for i in ranked]
+
+    def _rank_by_matching(self, key: str, candidates: int, limit: int) -> list[int]:
+        keys = self._keys
+        search = _subsequence_pattern(key).search
+        ranks = []
+        for i in self._positions(candidates):
+            start = keys[i].find(key)
+            if start >= 0:
+                ranks.append((0, start, i))
+            elif match := search(keys[i]):
+                # Matching from the first occurrence of each character ends earliest
+                ranks.append((1, match.end(), i))
+        return [rank[-1] for rank in heapq.nsmallest(limit, ranks)]
+
+    def _rank_by_position(self, key: str, candidates: int, limit: int) -> list[int]:
+        rows = self._position_masks
+        ranked: list[int] = []
+
+        # Names containing the query, a start position at a time. Masks are
+        # subtracted with XOR, as ANDing a negated mask is much slower.
+        rest = candidates
+        for start in range(len(rows) - len(key) + 1):
+            mask = rest
+            for offset, char in enumerate(key):
+                mask &= rows[start + offset].get(char, 0)
+                if not mask:
+                    break
+            else:
+                ranked += self._positions(mask, limit - len(ranked))
+                if len(ranked) == limit:
+                    return ranked
+                rest ^= mask
+
+        # Then the others, an end position at a time. matched[k] holds the
+        # names having the first k characters of the query before `end`.
+        matched = [rest] + [0] * len(key)
+        for end in range(1, len(rows) + 1):
+            row = rows[end - 1]
+            done = matched[-1]
+            # Backwards, so each step extends the matches of the previous position
+            for k in range(len(key), 0, -1):
+                if matched[k - 1]:
+                    matched[k] |= matched[k - 1] & row.get(key[k - 1], 0)
+            if matched[-1] != done:
+                ranked += self._positions(matched[-1] ^ done, limit - len(ranked))
+                if len(ranked) == limit:
+                    break
+        return ranked
+
+    def complete(self, query: str, limit: int = 50, fuzzy: bool = False) -> list[str]:
+        """Prefix matches, topped up with fuzzy matches when enabled and there are too few"""
+        matches = self.prefix(query, limit)
+        if fuzzy and len(matches) < limit:
+            seen = set(matches)
+            matches += [
+                name for name in self.fuzzy(query, limit) if name not in seen
+            ][: limit - len(matches)]
+        return matches
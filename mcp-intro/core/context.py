@@ -0,0 +1,216 @@
+import json
+import dataclasses
+from typing import Any, Awaitable, Callable, Optional
+
+from core.base import AsyncLLMProvider
+
+# Rough chars-per-token ratio, good enough to budget a request
+CHARS_PER_TOKEN = 4
+# Fixed per-message overhead (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+ELIDED_TOOL_RESULT = "[tool result elided to save context]"
+TRUNCATED_MARKER = "\n[... truncated to save context]"
+
+Summarizer = Callable[[list[dict]], Awaitable[str]]
+
+
+def _get(block: Any, key: str, default: Any = None) -> Any:
+    """Reads a field from a content block that is either a dict or an SDK object"""
+    if isinstance(block, dict):
+        return block.get(key, default)
+    return getattr(block, key, default)
+
+
+def jsonable(value: Any) -> Any:
+    """JSON fallback (`default=`) for SDK objects that end up in message histories"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return repr(value)
+
+
+def content_text(content: Any) -> str:
+    """Flattens message content into the text that will be sent to the model"""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(content_text(block) for block in content)
+
+    block_type = _get(content, "type")
+    if block_type == "text":
+        return _get(content, "text", "")
+    if block_type == "tool_use":
+        return f"{_get(content, 'name', '')} {json.dumps(_get(content, 'input', {}))}"
+    if block_type == "tool_result":
+        return content_text(_get(content, "content", ""))
+    # Ollama messages and anything else exposing a `content` attribute
+    return content_text(_get(content, "content", ""))
+
+
+def estimate_tokens(message: dict) -> int:
+    """Estimates the token count of a single message"""
+    return MESSAGE_OVERHEAD_TOKENS + len(content_text(message.get("content"))) // CHARS_PER_TOKEN
+
+
+def _is_tool_result_message(message: dict) -> bool:
+    content = message.get("content")
+    return isinstance(content, list) and any(
+        _get(block, "type") == "tool_result" for block in content
+    )
+
+
+def _is_turn_start(message: dict) -> bool:
+    """True for user messages that don't answer a previous tool call"""
+    return message.get("role") == "user" and not _is_tool_result_message(message)
+
+
+class ContextWindow:
+    """Keeps the chat history under a token budget by compacting old turns.
+
+    Compaction only touches messages older than the last `keep_recent` ones
+    and is applied in increasingly lossy steps until the history fits:
+    stale tool results are elided, long old texts are truncated, and
+    finally the oldest turns are dropped (or summarized, if a summarizer
+    is given).
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 100_000,
+        keep_recent: int = 6,
+        max_text_chars: int = 2_000,
+        summarizer: Optional[Summarizer] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.max_text_chars = max_text_chars
+        self.summarizer = summarizer
+        # id(message) -> (message, estimated tokens)
+        self._token_cache: dict[int, tuple[dict, int]] = {}
+
+    def message_tokens(self, message: dict) -> int:
+        cached = self._token_cache.get(id(message))
+        if cached is not None and cached[0] is message:
+            return cached[1]
+        tokens = estimate_tokens(message)
+        self._token_cache[id(message)] = (message, tokens)
+        return tokens
+
+    def total_tokens(self, messages: list[dict]) -> int:
+        return sum(self.message_tokens(message) for message in messages)
+
+    async def compact(self, messages: list[dict]) -> None:
+        """Compacts `messages` in place so they fit the token budget"""
+        if self.total_tokens(messages) > self.max_tokens:
+            for step in (self._elide_tool_results, self._truncate_texts):
+                step(messages)
+                if self.total_tokens(messages) <= self.max_tokens:
+                    break
+            else:
+                await self._drop_oldest_turns(messages)
+
+        # Forget messages that are no longer part of the history
+        live = {id(message) for message in messages}
+        for key in [key for key in self._token_cache if key not in live]:
+            del self._token_cache[key]
+
+    def _compactable(self, messages: list[dict]) -> range:
+        return range(max(len(messages) - self.keep_recent, 0))
+
+    def _elide_tool_results(self, messages: list[dict]) -> None:
+        for i in self._compactable(messages):
+            message = messages[i]
+            if not _is_tool_result_message(message):
+                continue
+            messages[i] = {
+                **message,
+                "content": [
+                    {**block, "content": ELIDED_TOOL_RESULT}
+                    if _get(block, "type") == "tool_result" and isinstance(block, dict)
+                    else block
+                    for block in message["content"]
+                ],
+            }
+
+    def _truncate_text(self, text: str) -> str:
+        if len(text) <= self.max_text_chars:
+            return text
+        return text[: self.max_text_chars] + TRUNCATED_MARKER
+
+    def _truncate_texts(self, messages: list[dict]) -> None:
+        for i in self._compactable(messages):
+            message = messages[i]
+            content = message.get("content")
+            if isinstance(content, str):
+                if len(content) > self.max_text_chars:
+                    messages[i] = {**message, "content": self._truncate_text(content)}
+            elif isinstance(content, list) and any(
+                _get(block, "type") == "text"
+                and len(_get(block, "text", "")) > self.max_text_chars
+                for block in content
+            ):
+                messages[i] = {
+                    **message,
+                    "content": [
+                        {"type": "text", "text": self._truncate_text(_get(block, "text", ""))}
+                        if _get(block, "type") == "text"
+                        else block
+                        for block in content
+                    ],
+                }
+
+    async def _drop_oldest_turns(self, messages: list[dict]) -> None:
+        # Only cut right before a fresh user turn so tool_use/tool_result pairs stay intact
+        remaining = self.total_tokens(messages)
+        cut = 0
+        for i in range(1, max(len(messages) - self.keep_recent, 0) + 1):
+            remaining -= self.message_tokens(messages[i - 1])
+            if i < len(messages) and _is_turn_start(messages[i]):
+                cut = i
+                if remaining <= self.max_tokens:
+                    break
+
+        if cut == 0:
+            return
+
+        dropped = messages[:cut]
+        del messages[:cut]
+        if self.summarizer is not None:
+            summary = await self.summarizer(dropped)
+            messages.insert(
+                0,
+                {
+                    "role": "user",
+                    "content": f"Summary of the earlier conversation:\n{summary}",
+                },
+            )
+
+
+def llm_summarizer(llm_service: AsyncLLMProvider) -> Summarizer:
+    """Builds a summarizer that asks the chat model itself to summarize dropped turns"""
+
+    async def summarize(messages: list[dict]) -> str:
+        transcript = "\n\n".join(
+            f"{message.get('role')}: {content_text(message.get('content'))}"
+            for message in messages
+        )
+        response = await llm_service.achat(
+            messages=[
+                {
+                    "role": "user",
+                    "content": "Summarize the following conversation in a few short "
+                    "bullet points, keeping facts, decisions and document ids:\n\n"
+                    f"<conversation>\n{transcript}\n</conversation>",
+                }
+            ],
+            temperature=0.0,
+        )
+        return llm_service.text_from_message(response)
+
+    return summarize
@@ -0,0 +1,170 @@
+import json
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Literal, Optional
+from core.base import ProviderType, StreamEvent
+from core.context import estimate_tokens, content_text, CHARS_PER_TOKEN
+
+
+@dataclass
+class FakeTextBlock:
+    text: str
+    type: Literal["text"] = "text"
+
+
+@dataclass
+class FakeToolUseBlock:
+    id: str
+    name: str
+    input: dict
+    type: Literal["tool_use"] = "tool_use"
+
+
+@dataclass
+class FakeMessage:
+    """Response shaped like an Anthropic Message, so tools and history handling work unchanged"""
+    content: list[FakeTextBlock | FakeToolUseBlock]
+    stop_reason: Literal["end_turn", "tool_use"] = "end_turn"
+    usage: dict[str, int] = field(default_factory=dict)
+    role: Literal["assistant"] = "assistant"
+
+
+class FakeProvider:
+    """Deterministic provider replaying a script of responses, for offline runs and benchmarks.
+
+    Each turn of the script is either a string (a final text answer) or a dict
+    with optional `text` and `tool_calls`, e.g.
+    `{"text": "Reading it", "tool_calls": [{"name": "read_doc_content", "input": {"doc_id": "plan.md"}}]}`.
+    The script is read from the JSON file named by `model` when no `script` is
+    given, and replays from the start once exhausted.
+    """
+
+    _provider_type: ProviderType = None
+
+    def __init__(
+        self,
+        model: str,
+        *args,
+        script: Optional[list[str | dict]] = None,
+        latency: float = 0.0,
+        **kwargs,
+    ):
+        if script is None:
+            if os.path.isfile(model):
+                with open(model) as f:
+                    script = json.load(f)
+            else:
+                script = [f"Hello from {model}"]
+        if not script:
+            raise ValueError("FakeProvider script must not be empty")
+        self.model = model
+        self.script = script
+        # Simulated model latency, in seconds per response
+        self.latency = latency
+        self.turn = 0
+        self._tool_use_count = 0
+
+    def add_user_message(self, messages: list[dict], message: dict | str) -> None:
+        messages.append({"role": "user", "content": message})
+
+    def add_assistant_message(self, messages: list[dict], message: Any) -> None:
+        messages.append({
+            "role": "assistant",
+            "content": message.content if isinstance(message, FakeMessage) else message,
+        })
+
+    def text_from_message(self, message: FakeMessage) -> str:
+        return "\n".join(
+            block.text for block in message.content if block.type == "text"
+        )
+
+    def has_tool_calls(self, response: FakeMessage) -> bool:
+        return response.stop_reason == "tool_use"
+
+    def usage(self, response: FakeMessage) -> dict[str, int]:
+        return dict(response.usage)
+
+    def reset(self) -> None:
+        """Replays the script from its first turn"""
+        self.turn = 0
+        self._tool_use_count = 0
+
+    def _next_response(self, messages: list[dict], system: str | None) -> FakeMessage:
+        step = self.script[self.turn % len(self.script)]
+        self.turn += 1
+        if isinstance(step, str):
+            step = {"text": step}
+
+        content: list[FakeTextBlock | FakeToolUseBlock] = []
+        if step.get("text"):
+            content.append(FakeTextBlock(step["text"]))
+        for call in step.get("tool_calls", []):
+            self._tool_use_count += 1
+            content.append(
+                FakeToolUseBlock(
+                    id=f"toolu_fake_{self._tool_use_count:06d}",
+                    name=call["name"],
+                    input=call.get("input", {}),
+                )
+            )
+
+        # Estimated like the context window does, so numbers are comparable across runs
+        input_tokens = sum(estimate_tokens(message) for message in messages)
+        if system:
+            input_tokens += len(system) // CHARS_PER_TOKEN
+        return FakeMessage(
+            content=content,
+            stop_reason="tool_use" if step.get("tool_calls") else "end_turn",
+            usage={
+                "input_tokens": input_tokens,
+                "output_tokens": len(content_text(content)) // CHARS_PER_TOKEN,
+            },
+        )
+
+    def chat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> FakeMessage:
+        return self._next_response(messages, system)
+
+    async def achat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> FakeMessage:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._next_response(messages, system)
+
+    async def astream(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> AsyncIterator[StreamEvent]:
+        response = await self.achat(messages, system=system, tools=tools)
+        for block in response.content:
+            if block.type == "text":
+                yield StreamEvent("text", text=block.text)
+            else:
+                yield StreamEvent("tool_use", tool_name=block.name)
+        yield StreamEvent("message", message=response)
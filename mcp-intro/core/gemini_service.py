@@ -1,5 +1,5 @@
-from typing import Any
-from core.base import ProviderType
+from typing import Any, AsyncIterator
+from core.base import ProviderType, StreamEvent
 
 class GeminiProvider:
 
@@ -21,6 +21,9 @@ class GeminiProvider:
     def has_tool_calls(self, response: Any) -> bool:
         """Check if the response contains tool calls"""
         raise NotImplementedError()
+
+    def usage(self, response: Any) -> dict[str, int]:
+        raise NotImplementedError()
     
     def chat(
         self,
@@ -35,4 +38,30 @@ class GeminiProvider:
     ) -> Any:
         raise NotImplementedError()
 
+    async def achat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> Any:
+        raise NotImplementedError()
+
+    def astream(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> AsyncIterator[StreamEvent]:
+        raise NotImplementedError()
+
         
\ No newline at end of file
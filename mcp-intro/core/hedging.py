@@ -0,0 +1,202 @@
+import time
+import asyncio
+from collections import deque
+from statistics import median
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from core.base import AsyncLLMProvider, ProviderWrapper, StreamEvent
+from core.telemetry import telemetry
+
+
+class LatencyWindow:
+    """Latencies of the last `size` requests to a provider, in seconds"""
+
+    def __init__(self, size: int = 100):
+        self.samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def median(self) -> Optional[float]:
+        return median(self.samples) if self.samples else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+# Windows are shared by name, so every session's provider learns from all requests
+_latency_windows: dict[str, LatencyWindow] = {}
+
+
+def latency_window(name: str) -> LatencyWindow:
+    if name not in _latency_windows:
+        _latency_windows[name] = LatencyWindow()
+    return _latency_windows[name]
+
+
+class HedgedProvider(ProviderWrapper):
+    """Sends a request to the fastest provider and hedges it with the next one if it's slow.
+
+    Providers are ranked by their rolling median latency, untried ones first.
+    The request goes to the first, and if it hasn't answered after its
+    `hedge_quantile` latency (`hedge_delay` until `min_samples` are known),
+    also to the next. Whichever answers first wins and the others are
+    cancelled. A provider that fails is replaced by the next one right away.
+    Streams are hedged until their first event.
+
+    The providers must share a ProviderType, since the messages they are
+    sent and the responses they return have to be interchangeable.
+    """
+
+    def __init__(
+        self,
+        providers: list[AsyncLLMProvider],
+        names: list[str] | None = None,
+        hedge_delay: float = 2.0,
+        hedge_quantile: float = 0.95,
+        min_hedge_delay: float = 0.05,
+        min_samples: int = 5,
+    ):
+        if not providers:
+            raise ValueError("HedgedProvider needs at least one provider")
+        provider_types = {provider._provider_type for provider in providers}
+        if len(provider_types) > 1:
+            raise ValueError("Hedged providers must share a provider type")
+        # Message and response helpers are delegated to the first provider
+        super().__init__(providers[0])
+        self.providers = providers
+        self.names = names or [
+            f"{provider._provider_type.value}:{provider.model}" for provider in providers
+        ]
+        self.latencies = [latency_window(name) for name in self.names]
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+
+    def _ranked(self) -> list[int]:
+        """Provider indexes, fastest first"""
+        return sorted(
+            range(len(self.providers)),
+            key=lambda i: (self.latencies[i].median() or 0.0, i),
+        )
+
+    def _delay(self, index: int) -> float:
+        latencies = self.latencies[index]
+        if len(latencies) < self.min_samples:
+            return self.hedge_delay
+        return max(latencies.quantile(self.hedge_quantile), self.min_hedge_delay)
+
+    async def _race(
+        self,
+        start: Callable[[AsyncLLMProvider], Awaitable[Any]],
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> Any:
+        """Runs `start` against the providers and returns the first result.
+
+        Results that lose the race, e.g. finishing in the same instant as
+        the winner, are passed to `discard` so their resources get released.
+        """
+        order = self._ranked()
+        pending: dict[asyncio.Task, tuple[int, float]] = {}
+        launched = 0
+        error: BaseException | None = None
+        losers: list[Any] = []
+
+        def launch() -> None:
+            nonlocal launched
+            index = order[launched]
+            launched += 1
+            task = asyncio.ensure_future(start(self.providers[index]))
+            pending[task] = (index, time.perf_counter())
+
+        launch()
+        try:
+            while pending:
+                # Hedge once the latest provider is slower than it usually is
+                timeout = self._delay(order[launched - 1]) if launched < len(order) else None
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    telemetry.count("llm_hedged_requests_total", provider=self.names[order[launched]])
+                    launch()
+                    continue
+
+                winner = None
+                failed = 0
+                for task in done:
+                    index, started = pending.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        failed += 1
+                    elif winner is None:
+                        winner = task
+                        self.latencies[index].add(time.perf_counter() - started)
+                    else:
+                        losers.append(task.result())
+
+                if winner is not None:
+                    now = time.perf_counter()
+                    # NOTE a cancelled provider took at least this long, recording it
+                    # keeps a provider that has turned slow from staying ranked first
+                    for other, other_started in pending.values():
+                        self.latencies[other].add(now - other_started)
+                    return winner.result()
+
+                # Replace failed providers right away, even while others still run
+                for _ in range(min(failed, len(order) - launched)):
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            if discard is not None:
+                # Tasks that finished before they could be cancelled lost too
+                losers += [result for result in results if not isinstance(result, BaseException)]
+                for result in losers:
+                    await discard(result)
+        raise error
+
+    def chat(self, messages: list[dict], **kwargs) -> Any:
+        # Blocking calls can't be raced, so only fall back on errors
+        error = None
+        for index in self._ranked():
+            start = time.perf_counter()
+            try:
+                response = self.providers[index].chat(messages, **kwargs)
+            except Exception as e:
+                error = e
+                continue
+            self.latencies[index].add(time.perf_counter() - start)
+            return response
+        raise error
+
+    async def achat(self, messages: list[dict], **kwargs) -> Any:
+        return await self._race(lambda provider: provider.achat(messages, **kwargs))
+
+    async def astream(self, messages: list[dict], **kwargs) -> AsyncIterator[StreamEvent]:
+        async def first_event(provider: AsyncLLMProvider):
+            stream = provider.astream(messages, **kwargs)
+            try:
+                return stream, await anext(stream)
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def close(result: tuple[AsyncIterator[StreamEvent], StreamEvent]) -> None:
+            await result[0].aclose()
+
+        stream, event = await self._race(first_event, discard=close)
+        try:
+            yield event
+            async for event in stream:
+                yield event
+        finally:
+            await stream.aclose()
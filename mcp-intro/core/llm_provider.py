@@ -1,34 +1,75 @@
-from typing import Any
+import importlib
+from typing import Any, Callable, Optional
 
-from core.base import LLMProvider, ProviderType
-from core.claude_service import ClaudeProvider
-from core.gemini_service import GeminiProvider
-from core.openai_service import OpenAIProvider
-from core.ollama_service import OllamaProvider
+from core.base import AsyncLLMProvider, ProviderType
+from core.hedging import HedgedProvider
 
 class LLMFactory:
     """Factory class to create LLM provider instances"""
 
-    _providers = {
-        ProviderType.CLAUDE: ClaudeProvider,
-        ProviderType.GEMINI: GeminiProvider,
-        ProviderType.OPENAI: OpenAIProvider,
-        ProviderType.OLLAMA: OllamaProvider,
+    # "module:Class" of each provider, imported on first use so only the
+    # selected provider's SDK is loaded
+    _providers: dict[ProviderType, str | type] = {
+        ProviderType.CLAUDE: "core.claude_service:ClaudeProvider",
+        ProviderType.GEMINI: "core.gemini_service:GeminiProvider",
+        ProviderType.OPENAI: "core.openai_service:OpenAIProvider",
+        ProviderType.OLLAMA: "core.ollama_service:OllamaProvider",
+        ProviderType.FAKE: "core.fake_service:FakeProvider",
     }
 
+    @classmethod
+    def register(cls, provider_type: ProviderType, provider: str | type) -> None:
+        """Register a provider class, or a "module:Class" path to import when it's first used"""
+        cls._providers[provider_type] = provider
+
+    @classmethod
+    def provider_class(cls, provider_type: ProviderType) -> type:
+        if provider_type not in cls._providers:
+            raise ValueError(f"Unsupported provider type: {provider_type}")
+
+        provider = cls._providers[provider_type]
+        if isinstance(provider, str):
+            module_name, _, class_name = provider.partition(":")
+            provider = getattr(importlib.import_module(module_name), class_name)
+            cls._providers[provider_type] = provider
+        return provider
+
     @classmethod
     def create_provider(
         cls,
         provider_type: ProviderType,
         model: str,
         api_key: str | None = None,
-    ) -> LLMProvider:
-        """Create a provider instance"""
-        if provider_type not in cls._providers:
-            raise ValueError(f"Unsupported provider type: {provider_type}")
-        
-        provider_class = cls._providers[provider_type]
-        llm_provider = provider_class(model=model, api_key=api_key)
+        **kwargs: Any,
+    ) -> AsyncLLMProvider:
+        """Create a provider instance, passing any extra options to the provider class"""
+        provider_class = cls.provider_class(provider_type)
+        llm_provider = provider_class(model=model, api_key=api_key, **kwargs)
         llm_provider._provider_type = provider_type
         return llm_provider
-    
\ No newline at end of file
+
+    @classmethod
+    def create_hedged_provider(
+        cls,
+        provider_type: ProviderType,
+        models: list[str],
+        api_key: str | None = None,
+        hedge_delay: float = 2.0,
+        hedge_quantile: float = 0.95,
+        wrap: Optional[Callable[[AsyncLLMProvider], AsyncLLMProvider]] = None,
+        **kwargs: Any,
+    ) -> HedgedProvider:
+        """Create a provider racing the given models, see HedgedProvider.
+
+        `wrap` is applied to each model's provider before it's raced, e.g. so
+        every request a hedge sends is rate limited on its own.
+        """
+        providers = [
+            cls.create_provider(provider_type, model, api_key=api_key, **kwargs)
+            for model in models
+        ]
+        if wrap is not None:
+            providers = [wrap(provider) for provider in providers]
+        return HedgedProvider(
+            providers, hedge_delay=hedge_delay, hedge_quantile=hedge_quantile
+        )
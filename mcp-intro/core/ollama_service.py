@@ -1,6 +1,21 @@
-from ollama import Client
+from typing import AsyncIterator, Optional
+from ollama import Client, AsyncClient
 from ollama import Message, ChatResponse
-from core.base import ProviderType
+from core.base import ProviderType, StreamEvent
+
+
+class OllamaResponse(Message):
+    """Assistant message carrying the token counts Ollama reports next to it"""
+    prompt_eval_count: Optional[int] = None
+    eval_count: Optional[int] = None
+
+    @classmethod
+    def from_chat_response(cls, response: ChatResponse) -> "OllamaResponse":
+        return cls.model_validate({
+            **response.message.model_dump(),
+            "prompt_eval_count": response.prompt_eval_count,
+            "eval_count": response.eval_count,
+        })
 
 class OllamaProvider:
 
@@ -8,6 +23,7 @@ class OllamaProvider:
 
     def __init__(self, model: str, *args, **kwargs):
         self.client = Client()
+        self.async_client = AsyncClient()
         self.model = model
     
     def add_user_message(self, messages: list[dict], message: str) -> None:
@@ -31,22 +47,29 @@ class OllamaProvider:
     def has_tool_calls(self, response: Message) -> bool:
         """Check if the response contains tool calls"""
         return hasattr(response, 'tool_calls') and response.tool_calls is not None
+
+    def usage(self, response: Message) -> dict[str, int]:
+        return {
+            "input_tokens": getattr(response, "prompt_eval_count", None) or 0,
+            "output_tokens": getattr(response, "eval_count", None) or 0,
+        }
     
-    def chat(
+    def _build_params(
         self,
         messages: list[dict],
         system: str | None = None,
         temperature: float = 1.0,
-        stop_sequences: list[str] = None,
+        stop_sequences: list[str] | None = None,
         tools: list[dict] | None = None,
         thinking: bool = False,
-        thinking_budget: int = 1024,
-        **kwargs,
-    ) -> Message:
+    ) -> dict:
         params = {
             "model": self.model,
             "messages": messages,
+            "options": {"temperature": temperature},
         }
+        if stop_sequences:
+            params["options"]["stop"] = stop_sequences
 
         if thinking:
             params["think"] = thinking
@@ -57,11 +80,91 @@ class OllamaProvider:
             params["tools"] = tools
         
         if system:
-            # NOTE not very optimised
-            messages.insert(0, {"role": "system", "content": system})
-        
+            # Prepend to a copy so the caller's history isn't mutated on every call
+            params["messages"] = [{"role": "system", "content": system}, *messages]
+
+        return params
+
+    def chat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> OllamaResponse:
+        params = self._build_params(
+            messages,
+            system=system,
+            temperature=temperature,
+            stop_sequences=stop_sequences,
+            tools=tools,
+            thinking=thinking,
+        )
         response: ChatResponse = self.client.chat(**params)
-        return response.message
+        return OllamaResponse.from_chat_response(response)
 
-        
-    
\ No newline at end of file
+    async def achat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> OllamaResponse:
+        params = self._build_params(
+            messages,
+            system=system,
+            temperature=temperature,
+            stop_sequences=stop_sequences,
+            tools=tools,
+            thinking=thinking,
+        )
+        response: ChatResponse = await self.async_client.chat(**params)
+        return OllamaResponse.from_chat_response(response)
+
+    async def astream(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> AsyncIterator[StreamEvent]:
+        params = self._build_params(
+            messages,
+            system=system,
+            temperature=temperature,
+            stop_sequences=stop_sequences,
+            tools=tools,
+            thinking=thinking,
+        )
+        content: list[str] = []
+        tool_calls: list[Message.ToolCall] = []
+        chunk: ChatResponse = None
+        async for chunk in await self.async_client.chat(**params, stream=True):
+            if chunk.message.content:
+                content.append(chunk.message.content)
+                yield StreamEvent("text", text=chunk.message.content)
+            for tool_call in chunk.message.tool_calls or []:
+                tool_calls.append(tool_call)
+                yield StreamEvent("tool_use", tool_name=tool_call.function.name)
+
+        # Token counts come with the final chunk
+        message = OllamaResponse(
+            role="assistant",
+            content="".join(content),
+            tool_calls=tool_calls or None,
+            prompt_eval_count=chunk.prompt_eval_count if chunk else None,
+            eval_count=chunk.eval_count if chunk else None,
+        )
+        yield StreamEvent("message", message=message)
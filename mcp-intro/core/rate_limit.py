@@ -0,0 +1,247 @@
+import time
+import random
+import asyncio
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Optional
+
+from core.base import AsyncLLMProvider, ProviderWrapper, StreamEvent
+from core.context import estimate_tokens
+from core.telemetry import telemetry
+
+# Rate limited, overloaded (Anthropic's 529) or a transient server error
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+# Connection and timeout errors of the provider SDKs (anthropic, httpx), matched
+# by name so no SDK has to be imported
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "TransportError"}
+
+
+class TokenBucket:
+    """Allows `rate` units per minute, in bursts of up to `capacity`.
+
+    Callers reserve units up front and are told how long to wait for them.
+    The level may go negative, which makes later callers wait in turn, so
+    waiters are served in order without a lock.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate / 60
+        self.capacity = capacity or rate
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` units, returns the seconds to wait before using them"""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Takes (or with a negative amount, returns) units without waiting"""
+        self.level -= amount
+
+
+@dataclass
+class RateLimits:
+    """Quota of a provider. 0 leaves a dimension unlimited."""
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+    max_concurrency: int = 0
+
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets plus a concurrency cap for one provider"""
+
+    def __init__(self, limits: RateLimits):
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_minute) if limits.requests_per_minute else None
+        self.tokens = TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+        self._slots = asyncio.Semaphore(limits.max_concurrency) if limits.max_concurrency else None
+        # Monotonic time until which the provider asked us to back off
+        self.paused_until = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        wait = self.paused_until - time.monotonic()
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return max(0.0, wait)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Corrects the tokens taken for a request once its actual usage is known"""
+        if self.tokens:
+            self.tokens.adjust(actual - estimated)
+
+    def pause(self, seconds: float) -> None:
+        """Holds back every request of the provider, e.g. after a retry-after"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: int) -> None:
+        if self._slots:
+            await self._slots.acquire()
+        try:
+            wait = self.reserve(tokens)
+            if wait > 0:
+                telemetry.observe("llm_rate_limit_wait_seconds", wait)
+                await asyncio.sleep(wait)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self) -> None:
+        if self._slots:
+            self._slots.release()
+
+
+# Limiters are shared by name, since a quota covers every session using the provider
+_rate_limiters: dict[str, RateLimiter] = {}
+
+
+def rate_limiter(name: str, limits: RateLimits) -> RateLimiter:
+    if name not in _rate_limiters:
+        _rate_limiters[name] = RateLimiter(limits)
+    return _rate_limiters[name]
+
+
+def is_retryable(error: BaseException) -> bool:
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked to wait, from the error's response headers"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    if value := headers.get("retry-after-ms"):
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if value := headers.get("retry-after"):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class RateLimitedProvider(ProviderWrapper):
+    """Throttles a provider to its quota and retries transient errors.
+
+    Each request takes a slot and waits for its share of the request and
+    token buckets, estimating its input tokens and settling with the actual
+    usage once answered. Rate limited, overloaded and connection errors are
+    retried up to `max_retries` times with jittered exponential backoff, or
+    after the server's retry-after, which also holds back the provider's
+    other requests. Streams are only retried before their first event.
+    """
+
+    def __init__(
+        self,
+        provider: AsyncLLMProvider,
+        limiter: RateLimiter,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        super().__init__(provider)
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _estimate_tokens(self, messages: list[dict], kwargs: dict) -> int:
+        tokens = sum(estimate_tokens(message) for message in messages)
+        if system := kwargs.get("system"):
+            tokens += estimate_tokens({"content": system})
+        return tokens
+
+    def _settle(self, estimated: int, response: Any) -> None:
+        try:
+            usage = self.provider.usage(response)
+        except NotImplementedError:
+            return
+        self.limiter.settle(estimated, sum(usage.values()))
+
+    def _retry_delay(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying, None if the error is final"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        if delay is not None:
+            self.limiter.pause(delay)
+        else:
+            # Full jitter, so concurrent sessions don't retry in lockstep
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        telemetry.count("llm_retries_total", error=type(error).__name__)
+        return delay
+
+    def chat(self, messages: list[dict], **kwargs) -> Any:
+        # NOTE blocking calls share the buckets and retries, not the async concurrency cap
+        estimated = self._estimate_tokens(messages, kwargs)
+        attempt = 0
+        while True:
+            time.sleep(self.limiter.reserve(estimated))
+            try:
+                response = self.provider.chat(messages, **kwargs)
+            except Exception as e:
+                if (delay := self._retry_delay(e, attempt)) is None:
+                    raise
+            else:
+                self._settle(estimated, response)
+                return response
+            attempt += 1
+            time.sleep(delay)
+
+    async def achat(self, messages: list[dict], **kwargs) -> Any:
+        estimated = self._estimate_tokens(messages, kwargs)
+        attempt = 0
+        while True:
+            await self.limiter.acquire(estimated)
+            try:
+                response = await self.provider.achat(messages, **kwargs)
+            except Exception as e:
+                if (delay := self._retry_delay(e, attempt)) is None:
+                    raise
+            else:
+                self._settle(estimated, response)
+                return response
+            finally:
+                # Released while backing off, so other requests can use the slot
+                self.limiter.release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def astream(self, messages: list[dict], **kwargs) -> AsyncIterator[StreamEvent]:
+        estimated = self._estimate_tokens(messages, kwargs)
+        attempt = 0
+        while True:
+            await self.limiter.acquire(estimated)
+            started = False
+            delay = None
+            try:
+                async for event in self.provider.astream(messages, **kwargs):
+                    started = True
+                    if event.type == "message":
+                        self._settle(estimated, event.message)
+                    yield event
+                return
+            except Exception as e:
+                if started or (delay := self._retry_delay(e, attempt)) is None:
+                    raise
+                attempt += 1
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(delay)
@@ -0,0 +1,320 @@
+import json
+import time
+import asyncio
+import pickle
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional
+
+from core.base import AsyncLLMProvider, ProviderWrapper, StreamEvent
+from core.context import jsonable
+from core.telemetry import telemetry
+
+
+def request_key(**request: Any) -> str:
+    """Hash of a request, the same for equal requests however they were built"""
+    canonical = json.dumps(
+        request, sort_keys=True, separators=(",", ":"), default=jsonable, ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseStore:
+    """Responses on disk in SQLite, keyed by request hash.
+
+    Entries older than `ttl` seconds are misses. Once the stored responses
+    exceed `max_bytes`, the least recently used ones are evicted. The store
+    can be shared by any number of providers and processes.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # NOTE WAL with synchronous=NORMAL doesn't fsync on every commit, so
+        # writes from the event loop stay cheap
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        # Covering the LRU walk of _evict, and the TTL sweep
+        self._db.execute("DROP INDEX IF EXISTS responses_last_used")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used_size ON responses (last_used, size)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        # Running byte total kept by triggers, so a put doesn't sum the table.
+        # Triggers rather than a counter in memory, as other processes write too.
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_bytes (total INTEGER NOT NULL)"
+            )
+            if self._db.execute("SELECT 1 FROM response_bytes").fetchone() is None:
+                self._db.execute(
+                    "INSERT INTO response_bytes SELECT COALESCE(SUM(size), 0) FROM responses"
+                )
+            for statement in (
+                """CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses
+                BEGIN UPDATE response_bytes SET total = total + new.size; END""",
+                """CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses
+                BEGIN UPDATE response_bytes SET total = total - old.size; END""",
+                """CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses
+                BEGIN UPDATE response_bytes SET total = total - old.size + new.size; END""",
+            ):
+                self._db.execute(statement)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+        try:
+            return pickle.loads(value)
+        except Exception:
+            # Written by an incompatible version of a provider SDK
+            self.delete(key)
+            return None
+
+    def put(self, key: str, response: Any) -> None:
+        value = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete
+            # wouldn't fire the trigger keeping the byte total
+            self._db.execute(
+                """INSERT INTO responses VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = excluded.value,
+                    size = excluded.size,
+                    created = excluded.created,
+                    last_used = excluded.last_used""",
+                (key, value, len(value), now, now),
+            )
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+        (total,) = self._db.execute("SELECT total FROM response_bytes").fetchone()
+        if total <= self.max_bytes:
+            return
+        # Walk from the least recently used entry until enough space is freed
+        excess = total - self.max_bytes
+        keys = []
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_used"
+        ):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+            (size,) = self._db.execute("SELECT total FROM response_bytes").fetchone()
+        return {"entries": entries, "bytes": size}
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class CachedProvider(ProviderWrapper):
+    """Wraps a provider to answer repeated requests from a ResponseStore.
+
+    A request is identified by the provider, model, messages, tools, system
+    prompt and sampling params. With `temperature_zero_only`, only requests
+    at temperature 0 are cached, since others are expected to vary.
+    Cached streams are replayed as one text event plus their tool_use events.
+    A hit reports the token usage of the response it replays.
+    """
+
+    def __init__(
+        self,
+        provider: AsyncLLMProvider,
+        store: ResponseStore,
+        temperature_zero_only: bool = False,
+    ):
+        super().__init__(provider)
+        self.store = store
+        self.temperature_zero_only = temperature_zero_only
+
+    def _key(self, temperature: float, **request: Any) -> Optional[str]:
+        if self.temperature_zero_only and temperature != 0:
+            return None
+        provider_type = self.provider._provider_type
+        return request_key(
+            provider=provider_type.value if provider_type else type(self.provider).__name__,
+            model=getattr(self.provider, "model", None),
+            temperature=temperature,
+            **request,
+        )
+
+    def _lookup(self, key: Optional[str]) -> Optional[Any]:
+        if key is None:
+            return None
+        response = self.store.get(key)
+        telemetry.count(
+            "llm_response_cache_total", result="hit" if response is not None else "miss"
+        )
+        return response
+
+    async def _alookup(self, key: Optional[str]) -> Optional[Any]:
+        # SQLite and unpickling are blocking, so they run off the event loop
+        return await asyncio.to_thread(self._lookup, key)
+
+    async def _astore(self, key: Optional[str], response: Any) -> None:
+        if key is not None:
+            await asyncio.to_thread(self.store.put, key, response)
+
+    def chat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> Any:
+        request = dict(
+            messages=messages,
+            system=system,
+            stop_sequences=stop_sequences or [],
+            tools=tools,
+            thinking=thinking,
+            thinking_budget=thinking_budget,
+            **kwargs,
+        )
+        key = self._key(temperature, **request)
+        response = self._lookup(key)
+        if response is None:
+            response = self.provider.chat(temperature=temperature, **request)
+            if key is not None:
+                self.store.put(key, response)
+        return response
+
+    async def achat(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> Any:
+        request = dict(
+            messages=messages,
+            system=system,
+            stop_sequences=stop_sequences or [],
+            tools=tools,
+            thinking=thinking,
+            thinking_budget=thinking_budget,
+            **kwargs,
+        )
+        key = self._key(temperature, **request)
+        response = await self._alookup(key)
+        if response is None:
+            response = await self.provider.achat(temperature=temperature, **request)
+            await self._astore(key, response)
+        return response
+
+    async def astream(
+        self,
+        messages: list[dict],
+        system: str | None = None,
+        temperature: float = 1.0,
+        stop_sequences: list[str] = None,
+        tools: list[dict] | None = None,
+        thinking: bool = False,
+        thinking_budget: int = 1024,
+        **kwargs,
+    ) -> AsyncIterator[StreamEvent]:
+        request = dict(
+            messages=messages,
+            system=system,
+            stop_sequences=stop_sequences or [],
+            tools=tools,
+            thinking=thinking,
+            thinking_budget=thinking_budget,
+            **kwargs,
+        )
+        key = self._key(temperature, **request)
+        response = await self._alookup(key)
+        if response is not None:
+            for event in self._replay(response):
+                yield event
+            return
+
+        async for event in self.provider.astream(temperature=temperature, **request):
+            if event.type == "message":
+                await self._astore(key, event.message)
+            yield event
+
+    def _replay(self, response: Any) -> list[StreamEvent]:
+        events = []
+        if text := self.provider.text_from_message(response):
+            events.append(StreamEvent("text", text=text))
+        content = getattr(response, "content", None)
+        # Claude style content blocks
+        if isinstance(content, list):
+            events += [
+                StreamEvent("tool_use", tool_name=block.name)
+                for block in content
+                if getattr(block, "type", None) == "tool_use"
+            ]
+        # Ollama style tool calls
+        events += [
+            StreamEvent("tool_use", tool_name=call.function.name)
+            for call in getattr(response, "tool_calls", None) or []
+        ]
+        events.append(StreamEvent("message", message=response))
+        return events
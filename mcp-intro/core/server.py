@@ -0,0 +1,322 @@
+import sys
+import json
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from sse_starlette.sse import EventSourceResponse
+
+from core.base import StreamEvent
+from core.cli_chat import CliChat
+from core.telemetry import telemetry
+
+
+class SessionNotFound(Exception):
+    pass
+
+
+class SessionBusy(Exception):
+    """The session is already running a turn"""
+
+
+class Overloaded(Exception):
+    """Too many sessions or turns, the client should retry later"""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass
+class Session:
+    id: str
+    chat: CliChat
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class Turn:
+    """A session's hold on a turn slot, released exactly once"""
+    session: Session
+    released: bool = False
+
+
+class SessionManager:
+    """Chat sessions sharing one pool of MCP clients.
+
+    Every session has its own history and runs one turn at a time. Across
+    sessions, at most `max_concurrent_turns` turns run at once and at most
+    `max_queued_turns` more wait for a slot. Past that, or after waiting
+    `queue_timeout` seconds, a turn is rejected with Overloaded so callers
+    back off instead of piling up. Sessions idle for `session_ttl` seconds
+    are dropped.
+    """
+
+    def __init__(
+        self,
+        make_session: Callable[[], CliChat],
+        max_sessions: int = 1000,
+        max_concurrent_turns: int = 64,
+        max_queued_turns: int = 256,
+        queue_timeout: float = 30.0,
+        session_ttl: float = 1800.0,
+    ):
+        self.make_session = make_session
+        self.max_sessions = max_sessions
+        self.max_queued_turns = max_queued_turns
+        self.queue_timeout = queue_timeout
+        self.session_ttl = session_ttl
+        self.sessions: dict[str, Session] = {}
+        self._turn_slots = asyncio.Semaphore(max_concurrent_turns)
+        self._queued = 0
+        self._in_flight = 0
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "turns_in_flight": self._in_flight,
+            "turns_queued": self._queued,
+        }
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_used > self.session_ttl and not session.lock.locked():
+                del self.sessions[session_id]
+
+    def create(self) -> Session:
+        self._evict_idle()
+        if len(self.sessions) >= self.max_sessions:
+            raise Overloaded(f"Session limit of {self.max_sessions} reached", retry_after=30)
+        chat = self.make_session()
+        # Clients get the text through events, keep it out of the server's stdout
+        chat.output = sys.stderr
+        session = Session(id=uuid.uuid4().hex, chat=chat)
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(session_id)
+        return session
+
+    def delete(self, session_id: str) -> None:
+        if self.sessions.pop(session_id, None) is None:
+            raise SessionNotFound(session_id)
+
+    async def acquire(self, session_id: str) -> Turn:
+        """Takes the session and a global turn slot, waiting for the slot if needed"""
+        session = self.get(session_id)
+        if session.lock.locked():
+            raise SessionBusy(session_id)
+        # Returns without suspending since the lock is free
+        await session.lock.acquire()
+        try:
+            if self._turn_slots.locked() and self._queued >= self.max_queued_turns:
+                raise Overloaded("Too many turns queued", status_code=429)
+            self._queued += 1
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    await self._turn_slots.acquire()
+            except TimeoutError:
+                raise Overloaded("Timed out waiting for a free turn slot")
+            finally:
+                self._queued -= 1
+        except BaseException:
+            session.lock.release()
+            raise
+        self._in_flight += 1
+        return Turn(session)
+
+    def release(self, turn: Turn) -> None:
+        if turn.released:
+            return
+        turn.released = True
+        self._in_flight -= 1
+        self._turn_slots.release()
+        turn.session.last_used = time.monotonic()
+        turn.session.lock.release()
+
+    @asynccontextmanager
+    async def turn(self, session_id: str) -> AsyncIterator[Session]:
+        """Holds the session and a global turn slot for the duration of a turn"""
+        turn = await self.acquire(session_id)
+        try:
+            yield turn.session
+        finally:
+            self.release(turn)
+
+
+def event_payload(chat: CliChat, event: StreamEvent) -> dict:
+    if event.type == "message":
+        return {
+            "type": "done",
+            "response": chat.llm_service.text_from_message(event.message),
+            "usage": dict(chat.usage),
+        }
+    payload = {"type": event.type}
+    if event.type in ("text", "tool_result"):
+        payload["text"] = event.text
+    if event.tool_name:
+        payload["tool_name"] = event.tool_name
+    if event.type == "tool_result":
+        payload["is_error"] = event.is_error
+    return payload
+
+
+def error_response(error: Exception) -> JSONResponse:
+    match error:
+        case SessionNotFound():
+            return JSONResponse({"error": "Session not found"}, status_code=404)
+        case SessionBusy():
+            return JSONResponse(
+                {"error": "Session is already running a turn"}, status_code=409
+            )
+        case Overloaded(status_code=status_code, retry_after=retry_after):
+            return JSONResponse(
+                {"error": str(error)},
+                status_code=status_code,
+                headers={"Retry-After": str(retry_after)},
+            )
+    raise error
+
+
+def create_app(manager: SessionManager) -> Starlette:
+    """HTTP and WebSocket API over a SessionManager.
+
+    POST   /sessions                    -> {"session_id": ...}
+    DELETE /sessions/{id}
+    POST   /sessions/{id}/messages      {"query": ...} -> {"response", "usage", "latency_ms"}
+                                        with ?stream=1, server-sent events instead
+    WS     /sessions/{id}/ws            send {"query": ...}, receive events until {"type": "done"}
+    GET    /health, GET /metrics (Prometheus text)
+    """
+
+    async def create_session(request: Request) -> Response:
+        try:
+            session = manager.create()
+        except Overloaded as e:
+            return error_response(e)
+        return JSONResponse({"session_id": session.id}, status_code=201)
+
+    async def delete_session(request: Request) -> Response:
+        try:
+            manager.delete(request.path_params["session_id"])
+        except SessionNotFound as e:
+            return error_response(e)
+        return Response(status_code=204)
+
+    async def post_message(request: Request) -> Response:
+        try:
+            body = await request.json()
+            query = body["query"]
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            return JSONResponse({"error": 'Expected a JSON body with a "query" string'}, status_code=400)
+
+        session_id = request.path_params["session_id"]
+        if request.query_params.get("stream") in ("1", "true"):
+            return await stream_message(session_id, query)
+
+        try:
+            async with manager.turn(session_id) as session:
+                start = time.perf_counter()
+                session.chat.usage.clear()
+                response = await session.chat.run(query)
+                return JSONResponse({
+                    "response": response,
+                    "usage": dict(session.chat.usage),
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                })
+        except (SessionNotFound, SessionBusy, Overloaded) as e:
+            return error_response(e)
+        except Exception as e:
+            return JSONResponse({"error": repr(e)}, status_code=500)
+
+    async def stream_message(session_id: str, query: str) -> Response:
+        # Take the turn before answering, so overload is reported as a status code
+        try:
+            turn = await manager.acquire(session_id)
+        except (SessionNotFound, SessionBusy, Overloaded) as e:
+            return error_response(e)
+        chat = turn.session.chat
+
+        async def events():
+            try:
+                chat.usage.clear()
+                async for event in chat.run_stream(query):
+                    payload = event_payload(chat, event)
+                    yield {"event": payload["type"], "data": json.dumps(payload)}
+            except Exception as e:
+                yield {"event": "error", "data": json.dumps({"type": "error", "error": repr(e)})}
+            finally:
+                manager.release(turn)
+
+        # The background task covers a client leaving before the stream started
+        return EventSourceResponse(events(), background=BackgroundTask(manager.release, turn))
+
+    async def websocket_session(websocket: WebSocket) -> None:
+        session_id = websocket.path_params["session_id"]
+        if session_id not in manager.sessions:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+        try:
+            while True:
+                try:
+                    message = await websocket.receive_json()
+                except ValueError:
+                    await websocket.send_json({"type": "error", "error": "Invalid JSON"})
+                    continue
+                query = message.get("query") if isinstance(message, dict) else None
+                if not isinstance(query, str):
+                    await websocket.send_json({"type": "error", "error": 'Expected {"query": ...}'})
+                    continue
+                try:
+                    async with manager.turn(session_id) as session:
+                        session.chat.usage.clear()
+                        async for event in session.chat.run_stream(query):
+                            await websocket.send_json(event_payload(session.chat, event))
+                except (SessionNotFound, SessionBusy, Overloaded) as e:
+                    await websocket.send_json({"type": "error", "error": str(e) or type(e).__name__})
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "error": repr(e)})
+        except WebSocketDisconnect:
+            pass
+
+    async def health(request: Request) -> Response:
+        return JSONResponse(manager.stats())
+
+    async def metrics(request: Request) -> Response:
+        return PlainTextResponse(telemetry.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    return Starlette(
+        routes=[
+            Route("/sessions", create_session, methods=["POST"]),
+            Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+            Route("/sessions/{session_id}/messages", post_message, methods=["POST"]),
+            WebSocketRoute("/sessions/{session_id}/ws", websocket_session),
+            Route("/health", health, methods=["GET"]),
+            Route("/metrics", metrics, methods=["GET"]),
+        ]
+    )
+
+
+async def serve(manager: SessionManager, host: str = "127.0.0.1", port: int = 8000) -> None:
+    import uvicorn
+
+    config = uvicorn.Config(create_app(manager), host=host, port=port, log_level="info")
+    await uvicorn.Server(config).serve()
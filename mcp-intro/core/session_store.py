@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Optional
+
+from core.context import jsonable
+
+SNAPSHOT_FILE = "snapshot.json"
+META_FILE = "meta.json"
+
+
+@dataclass
+class SessionInfo:
+    id: str
+    created: float
+    updated: float
+    messages: int = 0
+    title: str = ""
+
+
+def _write_atomic(path: Path, data: Any) -> None:
+    """Writes JSON so readers see either the old or the new file, even after a crash"""
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, default=jsonable, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class SessionLog:
+    """The history of one chat session on disk.
+
+    New messages are appended to a JSONL log. Every `snapshot_every` messages,
+    or whenever earlier messages changed (i.e. the context was compacted),
+    the full history is written to a snapshot and a fresh log is started, so
+    loading reads the snapshot plus at most `snapshot_every` log lines.
+    """
+
+    def __init__(self, path: Path, info: SessionInfo, snapshot_every: int = 50):
+        self.path = path
+        self.info = info
+        self.snapshot_every = snapshot_every
+        self.generation = 0
+        # The messages on disk, compared by identity to detect compaction,
+        # which replaces messages rather than editing them
+        self._persisted: list[dict] = []
+        self._logged = 0
+        self._log = None
+
+    @property
+    def id(self) -> str:
+        return self.info.id
+
+    def _log_path(self, generation: int) -> Path:
+        return self.path / f"log.{generation}.jsonl"
+
+    def load(self) -> list[dict]:
+        messages = []
+        snapshot = self.path / SNAPSHOT_FILE
+        if snapshot.exists():
+            with open(snapshot, encoding="utf-8") as f:
+                data = json.load(f)
+            self.generation = data["generation"]
+            messages = data["messages"]
+
+        log = self._log_path(self.generation)
+        if log.exists():
+            with open(log, "r+b") as f:
+                end = 0
+                for line in f:
+                    try:
+                        messages.append(json.loads(line))
+                    except ValueError:
+                        # A line cut short by a crash, drop it so appends stay readable
+                        f.truncate(end)
+                        break
+                    end += len(line)
+                    self._logged += 1
+        self._persisted = list(messages)
+        return messages
+
+    def save(self, messages: list[dict], query: str | None = None) -> None:
+        """Persists `messages`, appending what's new since the last save if possible"""
+        if query and not self.info.title:
+            self.info.title = " ".join(query.split())[:80]
+
+        persisted = self._persisted
+        rewritten = len(messages) < len(persisted) or any(
+            message is not old for message, old in zip(messages, persisted)
+        )
+        if not rewritten and len(messages) == len(persisted):
+            return
+        # Created on the first save, so sessions that never started leave nothing behind
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        if rewritten or self._logged + len(messages) - len(persisted) > self.snapshot_every:
+            self._snapshot(messages)
+        else:
+            if self._log is None:
+                self._log = open(self._log_path(self.generation), "a", encoding="utf-8")
+            self._log.write(
+                "".join(
+                    json.dumps(message, default=jsonable, ensure_ascii=False) + "\n"
+                    for message in messages[len(persisted):]
+                )
+            )
+            self._log.flush()
+            self._logged += len(messages) - len(persisted)
+
+        self._persisted = list(messages)
+        self.info.messages = len(messages)
+        self.info.updated = time.time()
+        _write_atomic(self.path / META_FILE, asdict(self.info))
+
+    def _snapshot(self, messages: list[dict]) -> None:
+        old_log = self._log_path(self.generation)
+        self.close()
+        self.generation += 1
+        _write_atomic(
+            self.path / SNAPSHOT_FILE,
+            {"generation": self.generation, "messages": messages},
+        )
+        # Only dropped once the snapshot covering it is in place
+        old_log.unlink(missing_ok=True)
+        self._logged = 0
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class SessionStore:
+    """Chat sessions saved under `root`, one directory per session"""
+
+    def __init__(self, root: str | Path = "~/.mcp-chat/sessions", snapshot_every: int = 50):
+        self.root = Path(root).expanduser()
+        self.snapshot_every = snapshot_every
+
+    def create(self) -> SessionLog:
+        now = time.time()
+        session_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + "-" + uuid.uuid4().hex[:6]
+        info = SessionInfo(id=session_id, created=now, updated=now)
+        return SessionLog(self.root / session_id, info, self.snapshot_every)
+
+    def open(self, session_id: str) -> SessionLog:
+        path = self.root / session_id
+        try:
+            with open(path / META_FILE, encoding="utf-8") as f:
+                info = SessionInfo(**json.load(f))
+        except FileNotFoundError:
+            raise KeyError(f"No session '{session_id}' in {self.root}") from None
+        return SessionLog(path, info, self.snapshot_every)
+
+    def list(self) -> list[SessionInfo]:
+        """Saved sessions, most recently updated first"""
+        sessions = []
+        for meta in self.root.glob(f"*/{META_FILE}"):
+            try:
+                with open(meta, encoding="utf-8") as f:
+                    sessions.append(SessionInfo(**json.load(f)))
+            except (OSError, ValueError, TypeError):
+                continue
+        return sorted(sessions, key=lambda info: info.updated, reverse=True)
+
+    def latest(self) -> Optional[str]:
+        sessions = self.list()
+        return sessions[0].id if sessions else None
@@ -0,0 +1,306 @@
+import json
+import time
+import random
+import asyncio
+import bisect
+import urllib.request
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Literal, Optional
+
+SERVICE_NAME = "mcp-chat"
+
+# Upper bounds, in seconds, of the span duration histogram buckets
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+ExportFormat = Literal["otlp", "prometheus"]
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    attributes: dict[str, Any] = field(default_factory=dict)
+    duration_ns: int = 0
+    error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class Histogram:
+    """Per-bucket (non-cumulative) counts plus sum and max of the observed values"""
+
+    def __init__(self, bounds: tuple[float, ...] = DURATION_BUCKETS):
+        self.bounds = bounds
+        # One extra bucket for values above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Telemetry:
+    """In-process spans, duration histograms and counters for the chat loop.
+
+    Spans nest through a context variable, so a tool call made during an
+    agent-loop iteration is recorded as its child, also across asyncio tasks.
+    Finished spans are kept in a bounded buffer until exported.
+    """
+
+    def __init__(self, max_spans: int = 4096, enabled: bool = True):
+        self.enabled = enabled
+        self.started_ns = time.time_ns()
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+        # (metric name, sorted label items) -> Histogram / counter value
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.counters: dict[tuple[str, tuple], float] = defaultdict(float)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Times the enclosed block as a span, which the block may add attributes to"""
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else f"{random.getrandbits(128):032x}",
+            span_id=f"{random.getrandbits(64):016x}",
+            parent_id=parent.span_id if parent else None,
+            start_ns=time.time_ns(),
+            attributes=attributes,
+        )
+        if not self.enabled:
+            yield span
+            return
+
+        _current_span.set(span)
+        start = time.perf_counter_ns()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration_ns = time.perf_counter_ns() - start
+            # Restore rather than reset with a token, which fails when an async
+            # generator holding the span is closed from another context
+            _current_span.set(parent)
+            self.spans.append(span)
+            self.observe("span_duration_seconds", span.duration_ns / 1e9, span=name)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def reset(self) -> None:
+        self.started_ns = time.time_ns()
+        self.spans.clear()
+        self.histograms.clear()
+        self.counters.clear()
+
+    def summary(self) -> str:
+        """Human readable table of span timings and counters, for the /stats command"""
+        lines = [f"{'span':<28} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name != "span_duration_seconds" or not histogram.count:
+                continue
+            lines.append(
+                f"{dict(labels)['span']:<28} {histogram.count:>6} "
+                f"{histogram.sum / histogram.count * 1000:>9.1f} "
+                f"{histogram.quantile(0.5) * 1000:>9.1f} "
+                f"{histogram.quantile(0.95) * 1000:>9.1f} "
+                f"{histogram.max * 1000:>9.1f}"
+            )
+        if self.counters:
+            lines.append("")
+            for (name, labels), value in sorted(self.counters.items()):
+                label_text = ",".join(f"{k}={v}" for k, v in labels)
+                lines.append(f"{name}{'{' + label_text + '}' if labels else ''} {value:g}")
+        return "\n".join(lines)
+
+    # --- Export ---
+
+    def to_prometheus(self) -> str:
+        """Renders metrics in the Prometheus text exposition format"""
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_prometheus_labels(labels)} {value:g}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip((*histogram.bounds, "+Inf"), histogram.counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{name}_bucket{_prometheus_labels((*labels, ('le', le)))} {cumulative}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} {histogram.sum:g}")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_otlp(self) -> dict[str, dict]:
+        """Builds OTLP/JSON trace and metric payloads, keyed by their /v1 endpoint"""
+        resource = {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})}
+        scope = {"name": SERVICE_NAME}
+        spans = [
+            {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.start_ns + span.duration_ns),
+                "attributes": _otlp_attributes(span.attributes),
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            for span in self.spans
+        ]
+
+        now = str(time.time_ns())
+        start = str(self.started_ns)
+        metrics = []
+        for (name, labels), value in sorted(self.counters.items()):
+            metrics.append({
+                "name": name,
+                "sum": {
+                    "dataPoints": [{
+                        "attributes": _otlp_attributes(dict(labels)),
+                        "startTimeUnixNano": start,
+                        "timeUnixNano": now,
+                        "asDouble": value,
+                    }],
+                    "aggregationTemporality": 2,
+                    "isMonotonic": True,
+                },
+            })
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            metrics.append({
+                "name": name,
+                "unit": "s",
+                "histogram": {
+                    "dataPoints": [{
+                        "attributes": _otlp_attributes(dict(labels)),
+                        "startTimeUnixNano": start,
+                        "timeUnixNano": now,
+                        "count": str(histogram.count),
+                        "sum": histogram.sum,
+                        "max": histogram.max,
+                        "bucketCounts": [str(count) for count in histogram.counts],
+                        "explicitBounds": list(histogram.bounds),
+                    }],
+                    "aggregationTemporality": 2,
+                },
+            })
+
+        return {
+            "traces": {"resourceSpans": [{"resource": resource, "scopeSpans": [{"scope": scope, "spans": spans}]}]},
+            "metrics": {"resourceMetrics": [{"resource": resource, "scopeMetrics": [{"scope": scope, "metrics": metrics}]}]},
+        }
+
+    async def export(self, destination: str, format: ExportFormat = "otlp") -> None:
+        """Writes telemetry to a file, or sends it to an http(s) endpoint.
+
+        OTLP is posted to `<destination>/v1/traces` and `<destination>/v1/metrics`
+        of a collector, Prometheus text is posted to `destination` as is,
+        e.g. a Pushgateway job URL.
+        """
+        if format == "prometheus":
+            payloads = {"": (self.to_prometheus(), "text/plain; version=0.0.4")}
+        else:
+            otlp = self.to_otlp()
+            payloads = {
+                f"/v1/{signal}": (json.dumps(payload), "application/json")
+                for signal, payload in otlp.items()
+            }
+
+        if destination.startswith(("http://", "https://")):
+            for path, (body, content_type) in payloads.items():
+                await asyncio.to_thread(_post, destination.rstrip("/") + path, body, content_type)
+            return
+
+        with open(destination, "w") as f:
+            if format == "prometheus":
+                f.write(payloads[""][0])
+            else:
+                json.dump(otlp, f)
+
+
+def _post(url: str, body: str, content_type: str) -> None:
+    request = urllib.request.Request(
+        url, data=body.encode(), headers={"Content-Type": content_type}, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=10):
+        pass
+
+
+def _prometheus_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict]:
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        converted.append({"key": key, "value": typed})
+    return converted
+
+
+# Shared by the whole process, like a global tracer/meter provider
+telemetry = Telemetry()
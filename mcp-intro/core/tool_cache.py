@@ -0,0 +1,88 @@
+import json
+from collections import OrderedDict, defaultdict
+from typing import Any, Optional
+from mcp.types import CallToolResult, Tool
+
+
+def is_read_only(tool: Tool) -> bool:
+    """True if the server marked the tool as read-only through its MCP annotations"""
+    return bool(tool.annotations and tool.annotations.readOnlyHint)
+
+
+def canonical_args(args: dict | None) -> str:
+    return json.dumps(args or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _identifier_args(args: dict | None) -> dict[str, Any]:
+    """Arguments naming the resource a tool works on, e.g. `doc_id`"""
+    return {
+        key: value
+        for key, value in (args or {}).items()
+        if key == "id" or key.endswith("_id")
+    }
+
+
+class ToolResultCache:
+    """Bounded LRU cache of read-only tool results.
+
+    Entries are keyed by (client id, tool name, canonical args). A call to a
+    mutating tool on a server drops that server's entries sharing one of its
+    identifier arguments (e.g. the same `doc_id`), plus entries that have no
+    identifier at all since they may depend on anything (e.g. a search).
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str, str], tuple[dict, CallToolResult]] = OrderedDict()
+        # Bumped on every invalidation, so results of calls that raced with a
+        # write are not cached
+        self._generations: dict[str, int] = defaultdict(int)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def generation(self, client_id: str) -> int:
+        return self._generations[client_id]
+
+    def get(self, client_id: str, tool_name: str, args: dict | None) -> Optional[CallToolResult]:
+        key = (client_id, tool_name, canonical_args(args))
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(
+        self,
+        client_id: str,
+        tool_name: str,
+        args: dict | None,
+        result: CallToolResult,
+        generation: int,
+    ) -> None:
+        if self.max_entries <= 0 or generation != self._generations[client_id]:
+            return
+        key = (client_id, tool_name, canonical_args(args))
+        self._entries[key] = (_identifier_args(args), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, client_id: str, args: dict | None = None) -> None:
+        """Drops the entries a mutating call with `args` may have made stale"""
+        self._generations[client_id] += 1
+        written = _identifier_args(args)
+        for key, (identifiers, _) in list(self._entries.items()):
+            if key[0] != client_id:
+                continue
+            if (
+                not written
+                or not identifiers
+                or any(identifiers.get(name) == value for name, value in written.items())
+            ):
+                del self._entries[key]
+
+    def clear(self, client_id: str) -> None:
+        self._generations[client_id] += 1
+        for key in [key for key in self._entries if key[0] == client_id]:
+            del self._entries[key]
@@ -1,12 +1,52 @@
+import re
+import sys
 import json
-from typing import Optional, Literal, List
+import asyncio
+from collections import defaultdict
+from typing import TYPE_CHECKING, Optional, Literal, List, NamedTuple
 from mcp.types import CallToolResult, Tool, TextContent
 from mcp_client import MCPClient
-from anthropic.types import Message, ToolResultBlockParam
 from core.base import LLMProvider, ProviderType
+from core.tool_cache import ToolResultCache, is_read_only
+from core.telemetry import telemetry
+
+if TYPE_CHECKING:
+    from anthropic.types import Message, ToolResultBlockParam
+
+
+class ToolRoute(NamedTuple):
+    client_id: str
+    client: MCPClient
+    tool: Tool
 
 
 class ToolManager:
+    # Separator between the client id and tool name in namespaced tool names
+    NAMESPACE_SEPARATOR = "__"
+
+    def __init__(
+        self,
+        clients: dict[str, MCPClient],
+        max_concurrency: int = 8,
+        max_concurrency_per_server: int = 4,
+        tool_timeout: Optional[float] = None,
+        result_cache_size: int = 256,
+    ):
+        self.clients: dict[str, MCPClient] = clients
+        # Max tool calls in flight for a single turn, and per server across turns
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_server = max_concurrency_per_server
+        self.tool_timeout = tool_timeout
+        self._server_limits: dict[MCPClient, asyncio.Semaphore] = {}
+        # Memoized results of read-only tools
+        self.result_cache = ToolResultCache(max_entries=result_cache_size)
+        # Routing index: advertised tool name -> (client id, server-side tool).
+        # Every tool is reachable by its namespaced name, and by its bare name
+        # when no other server exposes a tool with the same name.
+        self._routes: dict[str, tuple[str, Tool]] = {}
+        self._collisions: set[str] = set()
+        self._catalog_versions: Optional[dict[str, int]] = None
+
     @staticmethod
     def ollama_tool_schema_dict(mcp_tool: Tool) -> dict:
         """Convert MCP-Claude tool schema object to Ollama tool schema dict"""
@@ -47,34 +87,119 @@ class ToolManager:
                 }
 
 
+    @staticmethod
+    def tool_schema_dict(mcp_tool: Tool, provider_type: ProviderType) -> dict:
+        """Convert MCP tool schema object to the given provider's tool schema dict"""
+        match provider_type:
+            case ProviderType.OLLAMA:
+                return ToolManager.ollama_tool_schema_dict(mcp_tool)
+            case ProviderType.CLAUDE | ProviderType.FAKE:
+                return ToolManager.mcp_tool_schema_dict(mcp_tool)
+            case _:
+                raise NotImplementedError()
+
+    @staticmethod
+    def _rename_tool_schema(
+        schema: dict, name: str, provider_type: ProviderType
+    ) -> dict:
+        """Returns a copy of a provider tool schema dict advertised under another name"""
+        match provider_type:
+            case ProviderType.OLLAMA:
+                return {**schema, "function": {**schema["function"], "name": name}}
+            case _:
+                return {**schema, "name": name}
+
     @classmethod
-    async def get_all_tools(cls, clients: dict[str, MCPClient], llm_service: LLMProvider ) -> list[dict]:
-        """Gets all tools from the provided clients."""
-        tools = []
-        for client in clients.values():
-            tool_models = await client.list_tools()
-            for t in tool_models:
-                match llm_service._provider_type: 
-                    case ProviderType.OLLAMA:
-                        tool_dict = ToolManager.ollama_tool_schema_dict(t)
-                    case ProviderType.CLAUDE:
-                        tool_dict = ToolManager.mcp_tool_schema_dict(t)
-                    case _:
-                        raise NotImplementedError()
-                tools.append(tool_dict)
-        return tools
+    def namespaced_name(cls, client_id: str, tool_name: str) -> str:
+        """Builds the server-qualified name of a tool, e.g. `doc_client__read_doc_content`"""
+        # Provider tool names only allow [a-zA-Z0-9_-]
+        prefix = re.sub(r"[^a-zA-Z0-9_-]", "_", client_id)
+        return f"{prefix}{cls.NAMESPACE_SEPARATOR}{tool_name}"
 
     @classmethod
-    async def _find_client_with_tool(
-        cls, clients: list[MCPClient], tool_name: str
-    ) -> Optional[MCPClient]:
-        """Finds the first client that has the specified tool."""
-        for client in clients:
-            tools = await client.list_tools()
-            tool = next((t for t in tools if t.name == tool_name), None)
-            if tool:
-                return client
-        return None
+    def _provider_tool_schemas(
+        cls, client: MCPClient, tool_models: list[Tool], provider_type: ProviderType
+    ) -> list[dict]:
+        """Returns the client's tool schemas for a provider, translating them at most once per catalog."""
+        catalog = client.tool_catalog
+        schemas = catalog.schemas.get(provider_type)
+        if schemas is None:
+            schemas = [cls.tool_schema_dict(t, provider_type) for t in tool_models]
+            # Only keep the translation if the catalog wasn't invalidated meanwhile
+            if catalog.tools is tool_models:
+                catalog.schemas[provider_type] = schemas
+        return schemas
+
+    async def build_routes(self) -> list[list[Tool]]:
+        """Fetches every client's tool catalog and rebuilds the routing index if any of them changed.
+
+        Returns the tool lists of the clients, in the order of `self.clients`.
+        """
+        # Catalogs are cached per client, so this only hits servers whose
+        # catalog expired or got a tools/list_changed notification.
+        tool_lists = await asyncio.gather(
+            *(client.list_tools() for client in self.clients.values())
+        )
+        versions = {
+            client_id: client.tool_catalog.version
+            for client_id, client in self.clients.items()
+        }
+        if versions == self._catalog_versions:
+            return tool_lists
+
+        previous_versions = self._catalog_versions or {}
+        for client_id, version in versions.items():
+            if previous_versions.get(client_id) != version:
+                # The server's tools may have changed, so may their results
+                self.result_cache.clear(client_id)
+
+        routes: dict[str, tuple[str, Tool]] = {}
+        owners: dict[str, list[tuple[str, Tool]]] = defaultdict(list)
+        for client_id, tools in zip(self.clients, tool_lists):
+            for tool in tools:
+                routes[self.namespaced_name(client_id, tool.name)] = (client_id, tool)
+                owners[tool.name].append((client_id, tool))
+
+        collisions = set()
+        for tool_name, tool_owners in owners.items():
+            if len(tool_owners) == 1:
+                routes[tool_name] = tool_owners[0]
+            else:
+                collisions.add(tool_name)
+                if tool_name not in self._collisions:
+                    print(
+                        f"Tool '{tool_name}' is exposed by {', '.join(client_id for client_id, _ in tool_owners)}; "
+                        "advertising it under namespaced names instead",
+                        file=sys.stderr,
+                    )
+
+        self._routes = routes
+        self._collisions = collisions
+        self._catalog_versions = versions
+        return tool_lists
+
+    def route(self, tool_name: str) -> Optional[ToolRoute]:
+        """Looks up the client owning a tool and the tool as known to that server."""
+        route = self._routes.get(tool_name)
+        if route is None:
+            return None
+        client_id, tool = route
+        return ToolRoute(client_id, self.clients[client_id], tool)
+
+    async def get_all_tools(self, llm_service: LLMProvider) -> list[dict]:
+        """Gets all tools from the clients, as advertised to the llm provider."""
+        provider_type = llm_service._provider_type
+        tool_lists = await self.build_routes()
+        tools = []
+        for (client_id, client), tool_models in zip(self.clients.items(), tool_lists):
+            schemas = self._provider_tool_schemas(client, tool_models, provider_type)
+            for tool, schema in zip(tool_models, schemas):
+                if tool.name in self._collisions:
+                    schema = self._rename_tool_schema(
+                        schema, self.namespaced_name(client_id, tool.name), provider_type
+                    )
+                tools.append(schema)
+        return tools
 
     @classmethod
     def _build_tool_result_part(
@@ -82,7 +207,7 @@ class ToolManager:
         tool_use_id: str,
         text: str,
         status: Literal["success"] | Literal["error"],
-    ) -> ToolResultBlockParam:
+    ) -> "ToolResultBlockParam":
         """Builds a tool result part dictionary."""
         return {
             "tool_use_id": tool_use_id,
@@ -91,60 +216,128 @@ class ToolManager:
             "is_error": status == "error",
         }
 
-    # TODO need to make it generic to handle all llm providers
     @classmethod
-    async def execute_tool_requests(
-        cls, clients: dict[str, MCPClient], message: Message
-    ) -> List[ToolResultBlockParam]:
-        """Executes a list of tool requests against the provided clients."""
-        tool_requests = [
-            block for block in message.content if block.type == "tool_use"
+    def _tool_output_part(
+        cls, tool_use_id: str, tool_output: CallToolResult | None
+    ) -> "ToolResultBlockParam":
+        """Builds a tool result part from a tool call's output."""
+        items = []
+        if tool_output:
+            items = tool_output.content
+        content_list = [
+            item.text for item in items if isinstance(item, TextContent)
         ]
-        tool_result_blocks: list[ToolResultBlockParam] = []
-        for tool_request in tool_requests:
-            tool_use_id = tool_request.id
-            tool_name = tool_request.name
-            tool_input = tool_request.input
-
-            client = await cls._find_client_with_tool(
-                list(clients.values()), tool_name
-            )
+        content_json = json.dumps(content_list)
+        return cls._build_tool_result_part(
+            tool_use_id,
+            content_json,
+            "error"
+            if tool_output and tool_output.isError
+            else "success",
+        )
 
-            if not client:
-                tool_result_part = cls._build_tool_result_part(
-                    tool_use_id, "Could not find that tool", "error"
-                )
-                tool_result_blocks.append(tool_result_part)
-                continue
+    def _server_limit(self, client: MCPClient) -> asyncio.Semaphore:
+        """Returns the semaphore capping concurrent tool calls to a server"""
+        limit = self._server_limits.get(client)
+        if limit is None:
+            limit = asyncio.Semaphore(self.max_concurrency_per_server)
+            self._server_limits[client] = limit
+        return limit
+
+    async def _execute_tool_request(
+        self, tool_request, turn_limit: asyncio.Semaphore
+    ) -> "ToolResultBlockParam":
+        with telemetry.span("tool.execute", tool=tool_request.name) as span:
+            part = await self._run_tool_request(tool_request, turn_limit)
+            span.set("is_error", part["is_error"])
+            return part
+
+    async def _run_tool_request(
+        self, tool_request, turn_limit: asyncio.Semaphore
+    ) -> "ToolResultBlockParam":
+        """Executes a single tool request, turning any failure into an error result."""
+        tool_use_id = tool_request.id
+        tool_name = tool_request.name
+        tool_input = tool_request.input
 
+        route = self.route(tool_name)
+        if route is None:
+            # The tool may have appeared since the index was last built
             try:
-                tool_output: CallToolResult | None = await client.call_tool(
-                    tool_name, tool_input
-                )
-                items = []
-                if tool_output:
-                    items = tool_output.content
-                content_list = [
-                    item.text for item in items if isinstance(item, TextContent)
-                ]
-                content_json = json.dumps(content_list)
-                tool_result_part = cls._build_tool_result_part(
-                    tool_use_id,
-                    content_json,
-                    "error"
-                    if tool_output and tool_output.isError
-                    else "success",
-                )
+                await self.build_routes()
             except Exception as e:
-                error_message = f"Error executing tool '{tool_name}': {e}"
-                print(error_message)
-                tool_result_part = cls._build_tool_result_part(
-                    tool_use_id,
-                    json.dumps({"error": error_message}),
-                    "error"
-                    if tool_output and tool_output.isError
-                    else "success",
+                print(f"Error listing tools while looking up '{tool_name}': {e}", file=sys.stderr)
+            route = self.route(tool_name)
+
+        if not route:
+            return self._build_tool_result_part(
+                tool_use_id, "Could not find that tool", "error"
+            )
+
+        client_id, client, tool = route
+        read_only = is_read_only(tool)
+        if read_only:
+            cached = self.result_cache.get(client_id, tool.name, tool_input)
+            telemetry.count(
+                "tool_result_cache_total",
+                server=client_id,
+                result="miss" if cached is None else "hit",
+            )
+            if cached is not None:
+                return self._tool_output_part(tool_use_id, cached)
+
+        generation = self.result_cache.generation(client_id)
+        try:
+            async with turn_limit, self._server_limit(client):
+                tool_output: CallToolResult | None = await asyncio.wait_for(
+                    client.call_tool(tool.name, tool_input),
+                    self.tool_timeout,
+                )
+            if read_only and tool_output and not tool_output.isError:
+                self.result_cache.put(
+                    client_id, tool.name, tool_input, tool_output, generation
                 )
+            return self._tool_output_part(tool_use_id, tool_output)
+        except TimeoutError:
+            error_message = f"Tool '{tool_name}' timed out after {self.tool_timeout}s"
+        except Exception as e:
+            error_message = f"Error executing tool '{tool_name}': {e}"
+        finally:
+            if not read_only:
+                # Even a failed write may have changed something
+                self.result_cache.invalidate(client_id, tool_input)
 
-            tool_result_blocks.append(tool_result_part)
-        return tool_result_blocks
+        print(error_message, file=sys.stderr)
+        return self._build_tool_result_part(
+            tool_use_id,
+            json.dumps({"error": error_message}),
+            "error",
+        )
+
+    @staticmethod
+    def tool_requests(message: "Message") -> list:
+        """The tool_use blocks of a provider response"""
+        content = getattr(message, "content", None)
+        if not isinstance(content, list):
+            # TODO Ollama puts tool calls in `tool_calls`, which have no id to answer them by
+            raise NotImplementedError(
+                f"Tool calls in {type(message).__name__} responses are not supported yet"
+            )
+        return [block for block in content if getattr(block, "type", None) == "tool_use"]
+
+    # TODO need to make it generic to handle all llm providers
+    async def execute_tool_requests(
+        self, message: "Message"
+    ) -> List["ToolResultBlockParam"]:
+        """Executes the tool requests of a message concurrently against the clients.
+
+        Results are returned in the same order as the tool_use blocks.
+        """
+        tool_requests = self.tool_requests(message)
+        turn_limit = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(
+            *(
+                self._execute_tool_request(tool_request, turn_limit)
+                for tool_request in tool_requests
+            )
+        )
@@ -0,0 +1,212 @@
+from typing import Iterator, Optional
+
+# Collapse a table into a single piece once edits fragment it this much
+MAX_PIECES = 512
+
+
+class PieceTable:
+    """Editable text stored as a list of pieces over immutable strings.
+
+    Each piece is a (source, start, end) slice of either the original text
+    or the text inserted by an edit, so an edit only rewrites the piece list
+    and never copies the rest of the document. The full text is materialized
+    lazily and cached until the next edit.
+    """
+
+    def __init__(self, text: str = ""):
+        self._pieces: list[tuple[str, int, int]] = [(text, 0, len(text))] if text else []
+        self._length = len(text)
+        self._snapshot: Optional[str] = text
+
+    def __len__(self) -> int:
+        return self._length
+
+    def text(self) -> str:
+        """Returns the full text, cached until the next edit"""
+        if self._snapshot is None:
+            self._snapshot = "".join(src[s:e] for src, s, e in self._pieces)
+        return self._snapshot
+
+    def _spans(self, start: int, end: int) -> Iterator[tuple[int, str, int, int]]:
+        """Yields (offset, source, lo, hi) for the parts of pieces overlapping [start, end)"""
+        pos = 0
+        for src, s, e in self._pieces:
+            piece_start, pos = pos, pos + (e - s)
+            if pos <= start:
+                continue
+            if piece_start >= end:
+                break
+            lo = s + max(start - piece_start, 0)
+            hi = e - max(pos - end, 0)
+            yield piece_start + (lo - s), src, lo, hi
+
+    def _chunks(self, start: int, end: int) -> Iterator[tuple[int, str]]:
+        """Yields (offset, text) for the parts of pieces overlapping [start, end)"""
+        for offset, src, lo, hi in self._spans(start, end):
+            yield offset, src[lo:hi]
+
+    def slice(self, start: int, end: int) -> str:
+        """Returns text[start:end] without materializing the whole document"""
+        start = max(0, min(start, self._length))
+        end = max(start, min(end, self._length))
+        if self._snapshot is not None:
+            return self._snapshot[start:end]
+        return "".join(chunk for _, chunk in self._chunks(start, end))
+
+    def line_offset(self, line: int) -> int:
+        """Returns the offset where a 1-based line starts, or the length past the last line"""
+        remaining = line - 1
+        if remaining <= 0:
+            return 0
+        for offset, chunk in self._chunks(0, self._length):
+            count = chunk.count("\n")
+            if count >= remaining:
+                i = -1
+                for _ in range(remaining):
+                    i = chunk.index("\n", i + 1)
+                return offset + i + 1
+            remaining -= count
+        return self._length
+
+    def lines(self, start_line: int, end_line: int) -> str:
+        """Returns lines start_line..end_line (1-based, inclusive)"""
+        return self.slice(self.line_offset(start_line), self.line_offset(end_line + 1))
+
+    def find(self, sub: str, start: int = 0) -> int:
+        """Returns the offset of the first occurrence of `sub` at or after `start`, or -1"""
+        if self._snapshot is not None:
+            return self._snapshot.find(sub, start)
+        if not sub:
+            return start if start <= self._length else -1
+
+        # Search each piece's source in place, and the short window around
+        # every piece boundary for matches spanning it
+        keep = len(sub) - 1
+        carry = ""
+        for offset, src, lo, hi in self._spans(start, self._length):
+            if carry:
+                i = (carry + src[lo:min(hi, lo + keep)]).find(sub)
+                if i != -1:
+                    return offset - len(carry) + i
+            i = src.find(sub, lo, hi)
+            if i != -1:
+                return offset + (i - lo)
+            if keep:
+                carry = (carry + src[max(lo, hi - keep):hi])[-keep:]
+        return -1
+
+    def replace_range(self, start: int, end: int, text: str) -> None:
+        """Replaces text[start:end] with `text`, in O(pieces + len(text))"""
+        if not 0 <= start <= end <= self._length:
+            raise IndexError(f"Range {start}:{end} out of bounds for length {self._length}")
+        self._splice([(start, end)], text)
+
+    def _splice(self, ranges: list[tuple[int, int]], text: str) -> None:
+        """Replaces every (start, end) of sorted, non-overlapping `ranges` with `text`.
+
+        A single pass over the pieces, and every insertion shares one piece source.
+        """
+        old = self._pieces
+        pieces: list[tuple[str, int, int]] = []
+        i = 0
+        piece_start = 0
+
+        def copy(lo: int, hi: int) -> None:
+            # Keeps the original text in [lo, hi), walking the pieces forward only
+            nonlocal i, piece_start
+            while lo < hi:
+                src, s, e = old[i]
+                piece_end = piece_start + (e - s)
+                if lo < piece_end:
+                    stop = min(hi, piece_end)
+                    pieces.append((src, s + lo - piece_start, s + stop - piece_start))
+                    lo = stop
+                if lo >= piece_end:
+                    i += 1
+                    piece_start = piece_end
+
+        kept = 0
+        for start, end in ranges:
+            copy(kept, start)
+            if text:
+                pieces.append((text, 0, len(text)))
+            kept = end
+        copy(kept, self._length)
+
+        self._pieces = pieces
+        self._length += len(ranges) * len(text) - sum(end - start for start, end in ranges)
+        self._snapshot = None
+        if len(self._pieces) > MAX_PIECES:
+            self._reset(self.text())
+
+    def replace(self, old: str, new: str, occurrence: int = 0) -> int:
+        """Replaces the nth (1-based) occurrence of `old`, or every one when `occurrence` is 0.
+
+        Returns the number of replacements made.
+        """
+        if not old:
+            raise ValueError("old string must not be empty")
+
+        if occurrence == 0:
+            # Splices the matches into the pieces rather than rebuilding the text
+            ranges = []
+            index = self.find(old)
+            while index != -1:
+                ranges.append((index, index + len(old)))
+                index = self.find(old, index + len(old))
+            if ranges:
+                self._splice(ranges, new)
+            return len(ranges)
+
+        index = -len(old)
+        for _ in range(occurrence):
+            index = self.find(old, index + len(old))
+            if index == -1:
+                return 0
+        self.replace_range(index, index + len(old), new)
+        return 1
+
+    def _reset(self, text: str) -> None:
+        self._pieces = [(text, 0, len(text))] if text else []
+        self._length = len(text)
+        self._snapshot = text
+
+
+class DocumentStore:
+    """In-memory documents keyed by id, each backed by a PieceTable"""
+
+    def __init__(self, docs: Optional[dict[str, str]] = None):
+        self._docs: dict[str, PieceTable] = {
+            doc_id: PieceTable(text) for doc_id, text in (docs or {}).items()
+        }
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def ids(self) -> list[str]:
+        return list(self._docs.keys())
+
+    def put(self, doc_id: str, text: str) -> None:
+        self._docs[doc_id] = PieceTable(text)
+
+    def remove(self, doc_id: str) -> None:
+        del self._docs[doc_id]
+
+    def read(self, doc_id: str) -> str:
+        return self._docs[doc_id].text()
+
+    def slice(self, doc_id: str, start: int, end: int) -> str:
+        return self._docs[doc_id].slice(start, end)
+
+    def lines(self, doc_id: str, start_line: int, end_line: int) -> str:
+        return self._docs[doc_id].lines(start_line, end_line)
+
+    def size(self, doc_id: str) -> int:
+        return len(self._docs[doc_id])
+
+    def edit(self, doc_id: str, old_str: str, new_str: str, occurrence: int = 0) -> int:
+        """Replaces `old_str` in a document, returns the number of replacements"""
+        return self._docs[doc_id].replace(old_str, new_str, occurrence)
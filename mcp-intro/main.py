@@ -1,39 +1,276 @@
 import asyncio
+import argparse
 import sys
 import os
+import time
 from dotenv import load_dotenv
 from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING
 
 from mcp_client import MCPClient
 from core.llm_provider import LLMFactory
 from core.base import ProviderType
+from core.tools import ToolManager
+from core.context import ContextWindow, llm_summarizer
+from core.telemetry import telemetry
+from core.rate_limit import RateLimitedProvider, RateLimits, rate_limiter
 
 from core.cli_chat import CliChat
 from core.cli import CliApp
 
+# The response cache, session store and batch runner are imported where
+# they're used, so launches that have them off don't load them
+if TYPE_CHECKING:
+    from core.response_cache import ResponseStore
+    from core.session_store import SessionLog, SessionStore
+
 load_dotenv()
 
 # LLM Config
 PROVIDER= os.getenv("PROVIDER", "ollama")
 MODEL= os.getenv("MODEL", "gemma3:12b")
 API_KEY=os.getenv ("API_KEY", "")
+STREAM = os.getenv("STREAM", "0") == "1"
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "1.0"))
+# Comma separated models of the same provider to hedge MODEL with. A request
+# also goes to the next model once the first is slower than its HEDGE_QUANTILE
+# latency, or HEDGE_DELAY seconds while that isn't known yet
+HEDGE_MODELS = [model for model in os.getenv("HEDGE_MODELS", "").split(",") if model]
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "2.0"))
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+# Also offer fuzzy (subsequence) matches when completing prompts and doc ids
+FUZZY_COMPLETION = os.getenv("FUZZY_COMPLETION", "0") == "1"
+# Seconds between polls for new doc ids and prompts, backing off up to the max
+# while nothing changes. Only used for servers without list_changed notifications
+COMPLETION_REFRESH_INTERVAL = float(os.getenv("COMPLETION_REFRESH_INTERVAL", "5"))
+COMPLETION_REFRESH_MAX_INTERVAL = float(os.getenv("COMPLETION_REFRESH_MAX_INTERVAL", "60"))
+
+# Tool execution config
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "8"))
+TOOL_CONCURRENCY_PER_SERVER = int(os.getenv("TOOL_CONCURRENCY_PER_SERVER", "4"))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "0")) or None
+TOOL_RESULT_CACHE_SIZE = int(os.getenv("TOOL_RESULT_CACHE_SIZE", "256"))
+
+# Context window config
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "100000"))
+CONTEXT_SUMMARIZE = os.getenv("CONTEXT_SUMMARIZE", "0") == "1"
+
+# MCP server startup config
+SERVER_STARTUP_TIMEOUT = float(os.getenv("SERVER_STARTUP_TIMEOUT", "30"))
+# Lazy servers are spawned on their first tool call. Their tool catalogs are
+# saved under TOOL_CATALOG_DIR, so only the very first run has to start them
+# to list their tools
+LAZY_SERVERS = os.getenv("LAZY_SERVERS", "0") == "1"
+TOOL_CATALOG_DIR = os.getenv("TOOL_CATALOG_DIR", "~/.mcp-chat/tool_catalogs")
+# Run the bundled document server inside this process instead of a subprocess
+IN_PROCESS_DOC_SERVER = os.getenv("IN_PROCESS_DOC_SERVER", "0") == "1"
+
+# Telemetry config. Spans and metrics are exported on exit to a file path or
+# http(s) endpoint, as OTLP JSON ("otlp") or Prometheus text ("prometheus")
+TELEMETRY = os.getenv("TELEMETRY", "1") == "1"
+TELEMETRY_EXPORT = os.getenv("TELEMETRY_EXPORT", "")
+TELEMETRY_FORMAT = os.getenv("TELEMETRY_FORMAT", "otlp")
+
+# Provider quota, shared by all sessions. 0 leaves a limit off
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM", "0"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "0"))
+# Retries of rate limited, overloaded and connection errors, with jittered
+# exponential backoff between the delays unless the provider sends retry-after
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+
+# Response cache config. Repeated requests are answered from a SQLite file,
+# evicting least recently used responses past the size limit
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "~/.mcp-chat/response_cache.sqlite")
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "0")) or None
+# Only cache requests made at temperature 0
+RESPONSE_CACHE_TEMPERATURE_ZERO_ONLY = os.getenv("RESPONSE_CACHE_TEMPERATURE_ZERO_ONLY", "0") == "1"
+
+# Interactive sessions are saved under SESSION_DIR so they can be resumed,
+# with a full snapshot every SESSION_SNAPSHOT_EVERY messages
+SESSION_STORE = os.getenv("SESSION_STORE", "1") == "1"
+SESSION_DIR = os.getenv("SESSION_DIR", "~/.mcp-chat/sessions")
+SESSION_SNAPSHOT_EVERY = int(os.getenv("SESSION_SNAPSHOT_EVERY", "50"))
+PROMPT_HISTORY_FILE = os.getenv("PROMPT_HISTORY_FILE", "~/.mcp-chat/prompt_history")
+
+# Number of concurrent chat sessions in batch mode
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Server mode config
+SERVER_MAX_SESSIONS = int(os.getenv("SERVER_MAX_SESSIONS", "1000"))
+SERVER_MAX_CONCURRENT_TURNS = int(os.getenv("SERVER_MAX_CONCURRENT_TURNS", "64"))
+SERVER_MAX_QUEUED_TURNS = int(os.getenv("SERVER_MAX_QUEUED_TURNS", "256"))
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "30"))
+SERVER_SESSION_TTL = float(os.getenv("SERVER_SESSION_TTL", "1800"))
 
 
 assert PROVIDER, "Error: PROVIDER cannot be empty. Update .env"
 assert MODEL, "Error: MODEL cannot be empty. Update .env"
-if PROVIDER != ProviderType.OLLAMA.value:
+if PROVIDER not in (ProviderType.OLLAMA.value, ProviderType.FAKE.value):
     assert API_KEY, (
         "Error: API_KEY cannot be empty. Update .env"
     )
 
 
-async def main():
-    if PROVIDER == ProviderType.OLLAMA.value:
-        llm_service = LLMFactory.create_provider(provider_type=ProviderType(PROVIDER), model=MODEL)
+async def start_clients(clients: dict[str, MCPClient], required: set[str]):
+    """Starts all eager clients concurrently.
+
+    Optional clients that fail or time out are dropped with a warning,
+    a failing required client aborts startup.
+    """
+    eager = {client_id: client for client_id, client in clients.items() if not client.lazy}
+    results = await asyncio.gather(
+        *(client.start(client.startup_timeout) for client in eager.values()),
+        return_exceptions=True,
+    )
+    for client_id, result in zip(eager, results):
+        if not isinstance(result, BaseException):
+            continue
+        if client_id in required:
+            raise ConnectionError(f"Failed to start MCP server '{client_id}'") from result
+        print(f"Skipping MCP server '{client_id}', failed to start: {result!r}", file=sys.stderr)
+        del clients[client_id]
+
+
+async def stop_clients(clients: dict[str, MCPClient]):
+    await asyncio.gather(*(client.stop() for client in clients.values()))
+
+
+async def export_telemetry():
+    try:
+        await telemetry.export(TELEMETRY_EXPORT, TELEMETRY_FORMAT)
+    except Exception as e:
+        print(f"Failed to export telemetry to {TELEMETRY_EXPORT}: {e!r}", file=sys.stderr)
+
+
+def rate_limited(llm_service):
+    return RateLimitedProvider(
+        llm_service,
+        rate_limiter(
+            PROVIDER,
+            RateLimits(
+                requests_per_minute=RATE_LIMIT_RPM,
+                tokens_per_minute=RATE_LIMIT_TPM,
+                max_concurrency=LLM_MAX_CONCURRENCY,
+            ),
+        ),
+        max_retries=LLM_MAX_RETRIES,
+        base_delay=LLM_RETRY_BASE_DELAY,
+        max_delay=LLM_RETRY_MAX_DELAY,
+    )
+
+
+def create_llm_service(response_store: "ResponseStore | None" = None):
+    # SDK retries are off (max_retries=0), RateLimitedProvider does the retrying
+    api_key = None if PROVIDER in (ProviderType.OLLAMA.value, ProviderType.FAKE.value) else API_KEY
+    if HEDGE_MODELS:
+        # Limited per model, so each request a hedge sends counts against the quota
+        llm_service = LLMFactory.create_hedged_provider(
+            provider_type=ProviderType(PROVIDER),
+            models=[MODEL, *HEDGE_MODELS],
+            api_key=api_key,
+            hedge_delay=HEDGE_DELAY,
+            hedge_quantile=HEDGE_QUANTILE,
+            wrap=rate_limited,
+            max_retries=0,
+        )
     else:
-        llm_service = LLMFactory.create_provider(provider_type=ProviderType(PROVIDER), model=MODEL, api_key=API_KEY)
+        llm_service = rate_limited(
+            LLMFactory.create_provider(
+                provider_type=ProviderType(PROVIDER), model=MODEL, api_key=api_key, max_retries=0
+            )
+        )
+    if response_store is not None:
+        from core.response_cache import CachedProvider
+
+        llm_service = CachedProvider(
+            llm_service,
+            response_store,
+            temperature_zero_only=RESPONSE_CACHE_TEMPERATURE_ZERO_ONLY,
+        )
+    return llm_service
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Chat with documents and tools served over MCP")
+    parser.add_argument(
+        "server_scripts", nargs="*", help="Additional MCP server scripts to connect to"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Run the queries of a JSONL file ('-' for stdin) without the interactive CLI. "
+        'Each line is a JSON string or an object like {"id": "1", "query": "Summarize @report.pdf"}',
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=BATCH_CONCURRENCY,
+        help="Number of concurrent chat sessions in batch mode",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help="File to write batch results to as JSONL, defaults to stdout",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Serve chat sessions over HTTP and WebSocket instead of the interactive CLI",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to serve on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to serve on")
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="latest",
+        metavar="SESSION_ID",
+        help="Continue a saved session, the most recent one if no id is given",
+    )
+    parser.add_argument(
+        "--list-sessions", action="store_true", help="List saved sessions and exit"
+    )
+    return parser.parse_args()
+
+
+def list_sessions(store: "SessionStore") -> None:
+    for info in store.list():
+        updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(info.updated))
+        print(f"{info.id}  {updated}  {info.messages:>4} messages  {info.title}")
+
+
+def open_session_log(
+    store: "SessionStore", session_id: str | None
+) -> tuple["SessionLog", list[dict]]:
+    """A new session, or the saved one to resume along with its history"""
+    if session_id is None:
+        return store.create(), []
+    if session_id == "latest":
+        session_id = store.latest()
+        if session_id is None:
+            raise SystemExit(f"No saved sessions in {store.root}")
+    try:
+        session_log = store.open(session_id)
+    except KeyError as e:
+        raise SystemExit(e.args[0])
+    return session_log, session_log.load()
 
-    server_scripts = sys.argv[1:]
+
+async def main():
+    telemetry.enabled = TELEMETRY
+    cli_args = parse_args()
+
+    if cli_args.list_sessions:
+        from core.session_store import SessionStore
+
+        list_sessions(SessionStore(SESSION_DIR, snapshot_every=SESSION_SNAPSHOT_EVERY))
+        return
+
+    server_scripts = cli_args.server_scripts
     clients = {}
 
     command, args = (
@@ -42,26 +279,138 @@ async def main():
         else ("python", ["mcp_server.py"])
     )
 
+    if IN_PROCESS_DOC_SERVER:
+        from mcp_server import mcp as doc_server
+
+        doc_client = MCPClient.in_process(
+            doc_server,
+            cache_resources=True,
+            lazy=LAZY_SERVERS,
+            startup_timeout=SERVER_STARTUP_TIMEOUT,
+            catalog_dir=TOOL_CATALOG_DIR if LAZY_SERVERS else None,
+            name="doc_client",
+        )
+    else:
+        doc_client = MCPClient(
+            command=command,
+            args=args,
+            cache_resources=True,
+            lazy=LAZY_SERVERS,
+            startup_timeout=SERVER_STARTUP_TIMEOUT,
+            catalog_dir=TOOL_CATALOG_DIR if LAZY_SERVERS else None,
+            name="doc_client",
+        )
+    clients["doc_client"] = doc_client
+
+    for i, server_script in enumerate(server_scripts):
+        client_id = f"client_{i}_{server_script}"
+        clients[client_id] = MCPClient(
+            command="uv",
+            args=["run", server_script],
+            lazy=LAZY_SERVERS,
+            startup_timeout=SERVER_STARTUP_TIMEOUT,
+            catalog_dir=TOOL_CATALOG_DIR if LAZY_SERVERS else None,
+            name=client_id,
+        )
+
     async with AsyncExitStack() as stack:
-        doc_client = await stack.enter_async_context(
-            MCPClient(command=command, args=args)
+        if TELEMETRY_EXPORT:
+            stack.push_async_callback(export_telemetry)
+        stack.push_async_callback(stop_clients, dict(clients))
+        await start_clients(clients, required={"doc_client"})
+
+        tool_manager = ToolManager(
+            clients,
+            max_concurrency=TOOL_CONCURRENCY,
+            max_concurrency_per_server=TOOL_CONCURRENCY_PER_SERVER,
+            tool_timeout=TOOL_TIMEOUT,
+            result_cache_size=TOOL_RESULT_CACHE_SIZE,
         )
-        clients["doc_client"] = doc_client
+        if not LAZY_SERVERS:
+            # Build the tool routing index up front so the first turn doesn't pay for it
+            await tool_manager.build_routes()
+
+        response_store = None
+        if RESPONSE_CACHE:
+            from core.response_cache import ResponseStore
 
-        for i, server_script in enumerate(server_scripts):
-            client_id = f"client_{i}_{server_script}"
-            client = await stack.enter_async_context(
-                MCPClient(command="uv", args=["run", server_script])
+            response_store = ResponseStore(
+                RESPONSE_CACHE_PATH,
+                max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+                ttl=RESPONSE_CACHE_TTL,
             )
-            clients[client_id] = client
+            stack.callback(response_store.close)
 
-        chat = CliChat(
-            doc_client=doc_client,
-            clients=clients,
-            llm_service=llm_service,
+        # Built once, so sessions share the SDK clients and their connection
+        # pools. FakeProvider keeps its place in the script, so every session
+        # gets its own.
+        shared_llm_service = (
+            None if PROVIDER == ProviderType.FAKE.value else create_llm_service(response_store)
         )
 
-        cli = CliApp(chat)
+        def make_session(session_log: "SessionLog | None" = None) -> CliChat:
+            # Sessions share the MCP clients, tool manager, provider and
+            # response cache, but have their own history
+            llm_service = shared_llm_service or create_llm_service(response_store)
+            return CliChat(
+                doc_client=doc_client,
+                clients=clients,
+                llm_service=llm_service,
+                tool_manager=tool_manager,
+                temperature=LLM_TEMPERATURE,
+                session_log=session_log,
+                context=ContextWindow(
+                    max_tokens=CONTEXT_TOKEN_BUDGET,
+                    summarizer=llm_summarizer(llm_service) if CONTEXT_SUMMARIZE else None,
+                ),
+            )
+
+        if cli_args.batch:
+            from core.batch import run_batch
+
+            summary = await run_batch(
+                make_session,
+                cli_args.batch,
+                output_path=cli_args.output,
+                concurrency=cli_args.concurrency,
+            )
+            print(summary, file=sys.stderr)
+            return
+
+        if cli_args.serve:
+            # Imported here so the CLI doesn't load the web stack
+            from core.server import SessionManager, serve
+
+            manager = SessionManager(
+                make_session,
+                max_sessions=SERVER_MAX_SESSIONS,
+                max_concurrent_turns=SERVER_MAX_CONCURRENT_TURNS,
+                max_queued_turns=SERVER_MAX_QUEUED_TURNS,
+                queue_timeout=SERVER_QUEUE_TIMEOUT,
+                session_ttl=SERVER_SESSION_TTL,
+            )
+            await serve(manager, host=cli_args.host, port=cli_args.port)
+            return
+
+        session_log = None
+        if SESSION_STORE or cli_args.resume:
+            from core.session_store import SessionStore
+
+            session_store = SessionStore(SESSION_DIR, snapshot_every=SESSION_SNAPSHOT_EVERY)
+            session_log, messages = open_session_log(session_store, cli_args.resume)
+            stack.callback(session_log.close)
+        chat = make_session(session_log)
+        if cli_args.resume:
+            chat.messages = messages
+            print(f"Resumed session {session_log.id} ({len(messages)} messages)")
+        cli = CliApp(
+            chat,
+            stream=STREAM,
+            fuzzy_completion=FUZZY_COMPLETION,
+            refresh_interval=COMPLETION_REFRESH_INTERVAL,
+            max_refresh_interval=COMPLETION_REFRESH_MAX_INTERVAL,
+            history_file=PROMPT_HISTORY_FILE if SESSION_STORE else None,
+        )
         await cli.initialize()
         await cli.run()
 
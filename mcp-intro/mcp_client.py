@@ -1,13 +1,54 @@
+import os
 import sys
+import time
 import asyncio
-from typing import Optional, Any
+import hashlib
+from pathlib import Path
+from typing import Optional, Any, Callable, Literal
 from contextlib import AsyncExitStack
+import anyio
 from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
+from mcp.server.fastmcp import FastMCP
+from mcp.shared.memory import create_client_server_memory_streams
 
 import json
 from pydantic import AnyUrl
 
+from core.telemetry import telemetry
+
+
+class ToolCatalog:
+    """Cached tools/list result of a server, plus the provider schemas built from it"""
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.tools: Optional[list[types.Tool]] = None
+        # Translated tool schemas keyed by provider type
+        self.schemas: dict[Any, list[dict]] = {}
+        # Bumped on every store/invalidate so dependents can detect changes
+        self.version = 0
+        self._fetched_at = 0.0
+
+    def is_fresh(self) -> bool:
+        if self.tools is None:
+            return False
+        return self.ttl is None or time.monotonic() - self._fetched_at < self.ttl
+
+    def store(self, tools: list[types.Tool]) -> None:
+        self.tools = tools
+        self.schemas = {}
+        self._fetched_at = time.monotonic()
+        self.version += 1
+
+    def invalidate(self) -> None:
+        self.tools = None
+        self.schemas = {}
+        self.version += 1
+
+
+ListKind = Literal["tools", "resources", "prompts"]
+
 
 class MCPClient:
     def __init__(
@@ -15,27 +56,186 @@ class MCPClient:
         command: str,
         args: list[str],
         env: Optional[dict] = None,
+        tools_ttl: Optional[float] = 300.0,
+        cache_resources: bool = False,
+        resources_ttl: Optional[float] = None,
+        lazy: bool = False,
+        startup_timeout: Optional[float] = None,
+        name: Optional[str] = None,
+        catalog_dir: Optional[str | Path] = None,
     ):
+        # Label of the server in telemetry, defaults to the server script
+        self.name = name or (args[-1] if args else command)
         self._command = command
         self._args = args
         self._env = env
         self._session: Optional[ClientSession] = None
         self._exit_stack: AsyncExitStack = AsyncExitStack()
+        self.tool_catalog = ToolCatalog(ttl=tools_ttl)
+        self._tools_lock = asyncio.Lock()
+        # Resource contents keyed by uri, kept until the server reports a change
+        self.cache_resources = cache_resources
+        self.resources_ttl = resources_ttl
+        self._resource_cache: dict[str, tuple[float, Any]] = {}
+        # Bumped on every invalidation, so reads that raced with an update are not cached
+        self._resource_generation = 0
+        self._subscriptions: set[str] = set()
+        self._capabilities: Optional[types.ServerCapabilities] = None
+        # Lazy clients only spawn their server on the first request
+        self.lazy = lazy
+        self.startup_timeout = startup_timeout
+        self._runner: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._start_lock = asyncio.Lock()
+        # Tool catalogs are saved here, so a lazy client can advertise its
+        # tools without spawning the server until one is called
+        self.catalog_path = self._catalog_path(catalog_dir) if catalog_dir else None
+        # Set by in_process(), the server then runs in this process instead of a subprocess
+        self._server: Optional[FastMCP] = None
+        # Called with "tools", "resources" or "prompts" when the server reports its list changed
+        self._change_listeners: list[Callable[[ListKind], None]] = []
 
-    async def connect(self):
+    @classmethod
+    def in_process(cls, server: FastMCP, **kwargs) -> "MCPClient":
+        """Creates a client attached to a FastMCP instance over in-memory streams"""
+        kwargs.setdefault("name", server.name)
+        client = cls(command="", args=[], **kwargs)
+        client._server = server
+        return client
+
+    async def _in_process_transport(self):
+        client_streams, server_streams = await self._exit_stack.enter_async_context(
+            create_client_server_memory_streams()
+        )
+        server = self._server._mcp_server
+        server_read, server_write = server_streams
+
+        task_group = await self._exit_stack.enter_async_context(
+            anyio.create_task_group()
+        )
+        task_group.start_soon(
+            lambda: server.run(
+                server_read,
+                server_write,
+                server.create_initialization_options(),
+            )
+        )
+        # Exit stack unwinds in reverse, so the server is cancelled before its task group exits
+        self._exit_stack.callback(task_group.cancel_scope.cancel)
+        return client_streams
+
+    async def _stdio_transport(self):
         server_params = StdioServerParameters(
             command=self._command,
             args=self._args,
             env=self._env,
         )
-        stdio_transport = await self._exit_stack.enter_async_context(
+        return await self._exit_stack.enter_async_context(
             stdio_client(server_params)
         )
-        _stdio, _write = stdio_transport
+
+    async def connect(self):
+        if self._server is not None:
+            transport = await self._in_process_transport()
+        else:
+            transport = await self._stdio_transport()
+        _stdio, _write = transport
         self._session = await self._exit_stack.enter_async_context(
-            ClientSession(_stdio, _write)
+            ClientSession(_stdio, _write, message_handler=self._handle_message)
         )
-        await self._session.initialize()
+        result = await self._session.initialize()
+        self._capabilities = result.capabilities
+        # The catalog may have been loaded from disk, fetch the live one next time
+        self.tool_catalog.invalidate()
+
+    async def _handle_message(self, message) -> None:
+        """Handle server-initiated messages, used to keep local caches in sync"""
+        if not isinstance(message, types.ServerNotification):
+            return
+
+        match message.root:
+            case types.ToolListChangedNotification():
+                self.tool_catalog.invalidate()
+                self._notify_change("tools")
+            case types.ResourceUpdatedNotification(params=params):
+                self._invalidate_resource(str(params.uri))
+            case types.ResourceListChangedNotification():
+                self._resource_generation += 1
+                self._resource_cache.clear()
+                self._notify_change("resources")
+            case types.PromptListChangedNotification():
+                self._notify_change("prompts")
+
+    def add_change_listener(self, listener: Callable[[ListKind], None]) -> None:
+        """Registers a callback for list_changed notifications of the server"""
+        self._change_listeners.append(listener)
+
+    def _notify_change(self, kind: ListKind) -> None:
+        for listener in self._change_listeners:
+            listener(kind)
+
+    def notifies_list_changed(self, kind: ListKind) -> bool:
+        """Whether the server announced it sends list_changed notifications for `kind`"""
+        capability = getattr(self._capabilities, kind, None) if self._capabilities else None
+        return bool(capability and capability.listChanged)
+
+    async def start(self, timeout: Optional[float] = None) -> None:
+        """Connects from a dedicated task that owns the connection until `stop()`.
+
+        The transport's cancel scopes must be exited by the task that entered
+        them, so running the connection in its own task is what allows several
+        clients to be started concurrently, e.g. with asyncio.gather.
+        """
+        async with self._start_lock:
+            if self._session is not None:
+                return
+
+            ready = asyncio.get_running_loop().create_future()
+            self._stop_event = asyncio.Event()
+            self._runner = asyncio.create_task(self._run(ready, timeout))
+            try:
+                await asyncio.shield(ready)
+            except BaseException:
+                await self.stop()
+                raise
+
+    async def _run(self, ready: asyncio.Future, timeout: Optional[float]) -> None:
+        try:
+            async with asyncio.timeout(timeout):
+                await self.connect()
+            ready.set_result(None)
+            await self._stop_event.wait()
+        except asyncio.CancelledError:
+            # Only stop() cancels the runner. Clear the cancellation so the
+            # transport's own shutdown timeouts still work during cleanup.
+            asyncio.current_task().uncancel()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            if not ready.done():
+                ready.set_exception(ConnectionError("Client stopped while connecting"))
+            await self.cleanup()
+
+    async def stop(self) -> None:
+        """Closes a connection opened with `start()`"""
+        runner, self._runner = self._runner, None
+        if runner is None:
+            return
+        if self._session is None:
+            # Still connecting, nothing to shut down gracefully
+            runner.cancel()
+        self._stop_event.set()
+        await runner
+
+    async def _ensure_session(self) -> ClientSession:
+        if self._session is None and self.lazy:
+            await self.start(self.startup_timeout)
+        return self.session()
+
+    @property
+    def started(self) -> bool:
+        return self._session is not None
 
     def session(self) -> ClientSession:
         if self._session is None:
@@ -44,36 +244,143 @@ class MCPClient:
             )
         return self._session
 
-    async def list_tools(self) -> list[types.Tool]:
-        result = await self.session().list_tools()
-        return result.tools
+    async def list_tools(self, refresh: bool = False) -> list[types.Tool]:
+        """List the server's tools, served from the catalog cache while it is fresh"""
+        async with self._tools_lock:
+            if refresh or not self.tool_catalog.is_fresh():
+                saved = None
+                if self.lazy and not self.started and not refresh:
+                    saved = self._load_catalog()
+                if saved is not None:
+                    # Tools seen on a previous run, the server starts on the first call
+                    self.tool_catalog.store(saved)
+                else:
+                    with telemetry.span("mcp.list_tools", server=self.name) as span:
+                        result = await (await self._ensure_session()).list_tools()
+                        span.set("tool_count", len(result.tools))
+                    self.tool_catalog.store(result.tools)
+                    self._save_catalog(result.tools)
+            return self.tool_catalog.tools
+
+    def _catalog_path(self, catalog_dir: str | Path) -> Path:
+        # Keyed by how the server is launched, so another script gets its own catalog
+        key = json.dumps([self.name, self._command, self._args])
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return Path(catalog_dir).expanduser() / f"{digest}.json"
+
+    def _load_catalog(self) -> Optional[list[types.Tool]]:
+        if self.catalog_path is None:
+            return None
+        try:
+            with open(self.catalog_path, encoding="utf-8") as f:
+                return [types.Tool.model_validate(tool) for tool in json.load(f)]
+        except (OSError, ValueError):
+            return None
+
+    def _save_catalog(self, tools: list[types.Tool]) -> None:
+        if self.catalog_path is None:
+            return
+        try:
+            self.catalog_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.catalog_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump([tool.model_dump(mode="json") for tool in tools], f)
+            os.replace(tmp, self.catalog_path)
+        except OSError as e:
+            print(f"Failed to save the tool catalog of '{self.name}': {e!r}", file=sys.stderr)
 
     async def call_tool(
         self, tool_name: str, tool_input: dict
     ) -> types.CallToolResult | None:
-        return await self.session().call_tool(tool_name, tool_input)
+        with telemetry.span("mcp.call_tool", server=self.name, tool=tool_name) as span:
+            request_chars = len(json.dumps(tool_input or {}, default=str))
+            result = await (await self._ensure_session()).call_tool(tool_name, tool_input)
+            response_chars = sum(
+                len(item.text) for item in result.content if isinstance(item, types.TextContent)
+            )
+            span.set("request_chars", request_chars)
+            span.set("response_chars", response_chars)
+            span.set("is_error", result.isError)
+        self._count_payload("call_tool", request_chars, response_chars)
+        return result
 
     async def list_prompts(self) -> list[types.Prompt]:
-        result = await self.session().list_prompts()
+        with telemetry.span("mcp.list_prompts", server=self.name):
+            result = await (await self._ensure_session()).list_prompts()
         return result.prompts
 
     async def get_prompt(self, prompt_name, args: dict[str, str]):
-        result = await self.session().get_prompt(prompt_name, args)
+        with telemetry.span("mcp.get_prompt", server=self.name, prompt=prompt_name):
+            result = await (await self._ensure_session()).get_prompt(prompt_name, args)
         return result.messages
 
-    async def read_resource(self, uri: str) -> Any:
-        result = await self.session().read_resource(AnyUrl(uri))
-        resource = result.contents[0]
+    def _count_payload(self, method: str, request_chars: int, response_chars: int) -> None:
+        telemetry.count("mcp_request_chars_total", request_chars, server=self.name, method=method)
+        telemetry.count("mcp_response_chars_total", response_chars, server=self.name, method=method)
+
+    def _invalidate_resource(self, uri: str) -> None:
+        """Drops a cached resource and every cached resource nested under it"""
+        self._resource_generation += 1
+        prefix = uri.rstrip("/") + "/"
+        for cached_uri in list(self._resource_cache):
+            if cached_uri == uri or cached_uri.startswith(prefix):
+                del self._resource_cache[cached_uri]
+
+    def _cached_resource(self, uri: str) -> tuple[bool, Any]:
+        entry = self._resource_cache.get(uri)
+        if entry is None:
+            return False, None
+        fetched_at, value = entry
+        if self.resources_ttl is not None and time.monotonic() - fetched_at >= self.resources_ttl:
+            del self._resource_cache[uri]
+            return False, None
+        return True, value
+
+    async def _subscribe(self, uri: AnyUrl) -> None:
+        """Subscribes to updates of a cached resource if the server supports it"""
+        resources = self._capabilities.resources if self._capabilities else None
+        if not (resources and resources.subscribe) or str(uri) in self._subscriptions:
+            return
+        await self.session().subscribe_resource(uri)
+        self._subscriptions.add(str(uri))
+
+    async def read_resource(self, uri: str, refresh: bool = False) -> Any:
+        url = AnyUrl(uri)
+        if self.cache_resources and not refresh:
+            hit, value = self._cached_resource(str(url))
+            telemetry.count(
+                "mcp_resource_cache_total", server=self.name, result="hit" if hit else "miss"
+            )
+            if hit:
+                return value
+
+        generation = self._resource_generation
+        with telemetry.span("mcp.read_resource", server=self.name, uri=str(url)) as span:
+            result = await (await self._ensure_session()).read_resource(url)
+            resource = result.contents[0]
+            response_chars = len(resource.text) if isinstance(resource, types.TextResourceContents) else 0
+            span.set("response_chars", response_chars)
+        self._count_payload("read_resource", 0, response_chars)
 
+        value = None
         if isinstance(resource, types.TextResourceContents):
             if resource.mimeType == "application/json":
-                return json.loads(resource.text)
+                value = json.loads(resource.text)
+            else:
+                value = resource.text
 
-            return resource.text
+        if self.cache_resources and generation == self._resource_generation:
+            self._resource_cache[str(url)] = (time.monotonic(), value)
+            await self._subscribe(url)
+        return value
 
     async def cleanup(self):
         await self._exit_stack.aclose()
         self._session = None
+        self.tool_catalog.invalidate()
+        self._resource_generation += 1
+        self._resource_cache.clear()
+        self._subscriptions.clear()
 
     async def __aenter__(self):
         await self.connect()
@@ -1,53 +1,127 @@
+import json
+from urllib.parse import unquote
 from multiprocessing import Value
 from pydantic import Field
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 
 from pydantic import Field
 from mcp.server.fastmcp.prompts import base
+from mcp.types import ToolAnnotations
 from pydantic.type_adapter import P
+from pydantic import AnyUrl
+
+from document_store import DocumentStore
+from search_index import SearchIndex
 
 mcp = FastMCP("DocumentMCP", log_level="ERROR")
 
 
-docs = {
+docs = DocumentStore({
     "deposition.md": "This deposition covers the testimony of Angela Smith, P.E.",
     "report.pdf": "The report details the state of a 20m condenser tower.",
     "financials.docx": "These financials outline the project's budget and expenditures.",
     "outlook.pdf": "This document presents the projected future performance of the system.",
     "plan.md": "The plan outlines the steps for the project's implementation.",
     "spec.txt": "These specifications define the technical requirements for the equipment.",
-}
+})
+
+# Size of the chunks served by docs://documents/{doc_id}/chunks/{n}
+CHUNK_SIZE = 4096
+
+search_index = SearchIndex(load=docs.read)
+for _doc_id in docs.ids():
+    search_index.add(_doc_id, docs.read(_doc_id))
+
+
+def search_results(query: str, limit: int) -> list[dict]:
+    return [
+        {"doc_id": doc_id, "score": round(score, 4)}
+        for doc_id, score in search_index.search(query, limit)
+    ]
+
+def doc_info(doc_id: str) -> dict:
+    size = docs.size(doc_id)
+    return {
+        "doc_id": doc_id,
+        "size": size,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_count": max(-(-size // CHUNK_SIZE), 1),
+    }
 
 @mcp.tool(
     name="read_doc_content",
-    description="Read the contents of a document and return it as a string."
+    description="Read the contents of a document and return it as a string. "
+    "Large documents can be read in parts, either by character offset/length or by line range.",
+    annotations=ToolAnnotations(readOnlyHint=True, idempotentHint=True),
 )
 def read_document(
-    doc_id: str = Field(description="Id of the document to read")
+    doc_id: str = Field(description="Id of the document to read"),
+    offset: int = Field(default=0, description="Character offset to start reading at"),
+    length: int | None = Field(
+        default=None, description="Max number of characters to read, defaults to the rest of the document"
+    ),
+    start_line: int | None = Field(
+        default=None, description="First line to read (1-based). Takes precedence over offset/length"
+    ),
+    end_line: int | None = Field(
+        default=None, description="Last line to read (inclusive), defaults to the last line"
+    ),
 ):
     if doc_id not in docs:
         raise ValueError(f"Doc with id {doc_id} not found")
-    return docs[doc_id]
+    if start_line is not None or end_line is not None:
+        # A document never has more lines than characters + 1
+        last_line = end_line if end_line is not None else docs.size(doc_id) + 1
+        return docs.lines(doc_id, start_line or 1, last_line)
+    if offset or length is not None:
+        end = docs.size(doc_id) if length is None else offset + length
+        return docs.slice(doc_id, offset, end)
+    return docs.read(doc_id)
 
 @mcp.tool(
     name="edit_document",
-    description="Edit a document by replacing a string in the document's content with new string"
+    description="Edit a document by replacing a string in the document's content with new string",
+    annotations=ToolAnnotations(readOnlyHint=False, destructiveHint=False),
 )
-def edit_document(
+async def edit_document(
+    ctx: Context,
     doc_id: str = Field(),
     old_str: str = Field(),
     new_str: str = Field(),
+    occurrence: int = Field(
+        default=0,
+        description="1-based occurrence of old_str to replace. 0 replaces every occurrence",
+    ),
 ):
     if doc_id not in docs:
         raise ValueError(f"Doc with id {doc_id} not found")
-    docs[doc_id] = docs[doc_id].replace(old_str, new_str)
+    replaced = docs.edit(doc_id, old_str, new_str, occurrence)
+    if not replaced and occurrence:
+        raise ValueError(f"Occurrence {occurrence} of the given string not found in {doc_id}")
+    if replaced:
+        # Reindexed by the next search, so edits don't pay for it
+        search_index.mark_stale(doc_id)
+    # Let clients caching the document, its chunks or search results know they changed
+    await ctx.session.send_resource_updated(AnyUrl(f"docs://documents/{doc_id}"))
+    await ctx.session.send_resource_updated(AnyUrl("docs://search"))
+
+@mcp.tool(
+    name="search_docs",
+    description="Full-text search over all documents. Returns the ids of the best matching documents with their relevance score, best match first.",
+    annotations=ToolAnnotations(readOnlyHint=True, idempotentHint=True),
+)
+def search_docs(
+    query: str = Field(description="Words to search for"),
+    limit: int = Field(default=5, description="Maximum number of results"),
+) -> str:
+    return json.dumps(search_results(query, limit))
 
 @mcp.resource(
     "docs://documents",
     mime_type="application/json"
 )
 def list_docs() -> list[str]:
-    return list(docs.keys())
+    return docs.ids()
 
 @mcp.resource(
     "docs://documents/{doc_id}", mime_type="text/plain"
@@ -55,7 +129,39 @@ def list_docs() -> list[str]:
 def fetch_doc(doc_id: str) -> str:
     if doc_id not in docs:
         raise ValueError(f"Doc with id {doc_id} not found")
-    return docs[doc_id]
+    return docs.read(doc_id)
+
+@mcp.resource(
+    "docs://documents/{doc_id}/info", mime_type="application/json"
+)
+def fetch_doc_info(doc_id: str) -> dict:
+    if doc_id not in docs:
+        raise ValueError(f"Doc with id {doc_id} not found")
+    return doc_info(doc_id)
+
+@mcp.resource(
+    "docs://documents/{doc_id}/chunks/{n}", mime_type="application/json"
+)
+def fetch_doc_chunk(doc_id: str, n: str) -> dict:
+    if doc_id not in docs:
+        raise ValueError(f"Doc with id {doc_id} not found")
+    info = doc_info(doc_id)
+    index = int(n)
+    if not 0 <= index < info["chunk_count"]:
+        raise ValueError(f"Chunk {n} out of range for {doc_id}, it has {info['chunk_count']} chunks")
+    offset = index * CHUNK_SIZE
+    return {
+        **info,
+        "chunk": index,
+        "offset": offset,
+        "text": docs.slice(doc_id, offset, offset + CHUNK_SIZE),
+    }
+
+@mcp.resource(
+    "docs://search/{query}", mime_type="application/json"
+)
+def search_docs_resource(query: str) -> list[dict]:
+    return search_results(unquote(query), 10)
 
 @mcp.prompt(
     name="format",
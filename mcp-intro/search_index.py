@@ -0,0 +1,102 @@
+import re
+import math
+import heapq
+from collections import Counter, defaultdict
+from typing import Callable, Optional
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index over documents, ranked with BM25.
+
+    Documents are (re)indexed one at a time. Given a `load` function, edited
+    documents can instead be marked stale and are reindexed by the next
+    search, so a run of edits costs nothing until the index is queried.
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        load: Optional[Callable[[str], str]] = None,
+    ):
+        self.k1 = k1
+        self.b = b
+        # Reads a document's current text, to reindex stale documents
+        self.load = load
+        self._stale: set[str] = set()
+        # term -> {doc_id: term frequency}
+        self._postings: dict[str, dict[str, int]] = defaultdict(dict)
+        # doc_id -> term frequencies, used to unindex a document
+        self._doc_terms: dict[str, Counter] = {}
+        self._doc_lengths: dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, doc_id: str, text: str) -> None:
+        """Indexes a document, replacing any previous version of it"""
+        self.remove(doc_id)
+        self._stale.discard(doc_id)
+        terms = Counter(tokenize(text))
+        for term, freq in terms.items():
+            self._postings[term][doc_id] = freq
+        self._doc_terms[doc_id] = terms
+        length = sum(terms.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+
+    def mark_stale(self, doc_id: str) -> None:
+        """Reindexes a document from `load` on the next search"""
+        if self.load is None:
+            raise ValueError("Marking documents stale needs a load function")
+        self._stale.add(doc_id)
+
+    def _reindex_stale(self) -> None:
+        for doc_id in list(self._stale):
+            try:
+                text = self.load(doc_id)
+            except KeyError:
+                # Deleted since it was edited
+                self.remove(doc_id)
+                self._stale.discard(doc_id)
+                continue
+            self.add(doc_id, text)
+
+    def remove(self, doc_id: str) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, float]]:
+        """Returns up to `limit` (doc_id, score) pairs, best match first"""
+        if self._stale:
+            self._reindex_stale()
+        if not self._doc_lengths:
+            return []
+
+        doc_count = len(self._doc_lengths)
+        avg_length = self._total_length / doc_count or 1
+        scores: dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])